@@ -9,18 +9,26 @@ Created on Thu Dec 23 12:31:15 2021
 import pygame
 import os
 import random
-import math
 import sys
 import neat
 import numpy as np
-import sympy as sy
-import sympy.geometry as gm
 import Road as road
-import pickle
+import sensors
+import rotation_cache
+import car_batch
+from car_batch import CarBatch, Crash
+from batch_net import BatchNetwork, PROGRAMS
+import checkpoint
+import hall_of_fame
+import tracks
+import telemetry
+import replay
+from termination import TerminationPolicy
+import multiprocessing
+from time import perf_counter
 
 
 
-pygame.init()
 
 FUCSIA = (255,0,255)
 WHITE = (255, 255, 255)
@@ -36,18 +44,59 @@ BLACK = (0, 0, 0)         # Crayola Black
 
 SCREEN_WIDTH = 1400
 SCREEN_HEIGHT = 700
-SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+# Off-screen until run() opens the window, so headless training never needs a display
+SCREEN = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+road.SCREEN = SCREEN
+HEADLESS = False
+# Without HEADLESS, draw every RENDER_EVERY-th tick, or RENDER_FPS times a second when set
+RENDER_EVERY = 1
+RENDER_FPS = None
+# Draw only the SPECTATE live cars with the highest fitness, None draws them all
+SPECTATE = None
+# Directory eval_genomes records its episodes to, see replay; None records nothing
+RECORD_DIR = None
+# TerminationPolicy ending episodes early, None runs them until every car crashed
+TERMINATION = None
+# Every genome drives EPISODE_TRACKS tracks at once; AGGREGATE folds their
+# fitnesses into one: 'mean', 'min' or a quantile between 0 and 1
+EPISODE_TRACKS = 1
+AGGREGATE = 'mean'
 
-CAR = pygame.image.load(os.path.join("CarAssets", "carf.png"))
+CAR = None  # loaded by car_image()
 
 SPEED = 50
 
-FONT = pygame.font.Font('freesansbold.ttf', 20)
+FONT = None  # opened by init_display()
 
+SCORES = []
 
-TRACK = pygame.image.load(os.path.join("CarAssets", "track2.png"))
+# Memory-mapped track library, see load_tracks; None draws a random track per episode
+TRACK_LIBRARY = None
+track_index = None
+
+episode_ticks = 0  # frames simulated by the last eval_genomes
+
+# 0 is silent, 1 prints the telemetry of each generation, 2 also every crash
+VERBOSITY = 1
+# TickStats of the episodes since the last take_generation_stats
+generation_stats = telemetry.TickStats()
 
-SCORES = []
+
+def init_display():
+    """Opens the pygame window and makes it the drawing target of cars and road."""
+    global SCREEN, FONT
+    pygame.init()
+    SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    road.SCREEN = SCREEN
+    FONT = pygame.font.Font('freesansbold.ttf', 20)
+
+
+def car_image():
+    """The car sprite, loaded on first use."""
+    global CAR
+    if CAR is None:
+        CAR = pygame.image.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "CarAssets", "carf.png"))
+    return CAR
 
 air_density = 1.225
 friction_coef = 1.7
@@ -57,11 +106,13 @@ g = 9.8
 
 MAX_FRONT_ACC = 10
 DRAG_SCALING = 0.1
-MAX_VELOCITY = 10
+MAX_VELOCITY = car_batch.MAX_VELOCITY
 
 class Car(pygame.sprite.Sprite):
-    def __init__(self, img=CAR):
+    def __init__(self, img=None):
         super().__init__()
+        if img is None:
+            img = car_image()
         self.image_ori = img
         # self.image_ori.set_colorkey(WHITE)
         # self.image_ori(WHITE).convert_apha()
@@ -70,6 +121,7 @@ class Car(pygame.sprite.Sprite):
         self.h_ori = img.get_height()
         
         self.image = img
+        self.rotation = rotation_cache.rotate(img, 0)
         
         
         self.front_acc_time = 0
@@ -198,31 +250,21 @@ class Car(pygame.sprite.Sprite):
         center_x = self.rect.centerx
         center_y = self.rect.centery
 
-        self.image = pygame.transform.rotate(self.image_ori, self.body_orientation)
+        self.rotation = rotation_cache.rotate(self.image_ori, self.body_orientation)
+        self.image = self.rotation.image
        # new_rect = rotated_image.get_rect(center = self.image.get_rect(center = (center_x, center_y)).center)    
        # self.image = rotated_image
        # self.rect = new_rect
         self.rect = self.image.get_rect(center=self.rect.center) 
         
     def draw_sensors(self):
-        if (self.body_orientation <= 90 and self.body_orientation >= 0):
-            self.left_sensor = [self.rect.x + self.w_ori*(math.cos(np.radians(self.body_orientation))), self.rect.y]
-            self.right_sensor = [self.rect.x + self.image.get_width(), self.rect.y + self.h_ori*math.cos(np.radians(self.body_orientation))]
-        elif(self.body_orientation < 360 and self.body_orientation >= 270):
-            self.left_sensor = [self.rect.x + self.image.get_width(), self.rect.y + self.w_ori*(-1)*math.sin(np.radians(self.body_orientation))]
-            self.right_sensor = [self.rect.x + self.w_ori*math.cos(np.radians(self.body_orientation)), self.rect.y + self.image.get_height()]
-        elif(self.body_orientation >= 180 and self.body_orientation < 270):
-            self.left_sensor = [self.rect.x + self.h_ori*(-1)*math.sin(np.radians(self.body_orientation)), self.rect.y + self.image.get_height()]
-            self.right_sensor = [self.rect.x , self.rect.y + self.w_ori*(-1)*math.sin(np.radians(self.body_orientation))]
-        elif(self.body_orientation > 90 and self.body_orientation < 180):
-            self.left_sensor = [self.rect.x, self.rect.y + self.h_ori*(-1)*math.cos(np.radians(self.body_orientation))]
-            self.right_sensor = [self.rect.x + self.h_ori*math.sin(np.radians(self.body_orientation)) ,self.rect.y]
-
-        
-        self.know = [self.rect.x, self.rect.y]
-        self.know2 = [self.rect.x + self.image.get_width(), self.rect.y + self.image.get_height()]
-        self.know3 = [self.rect.x + self.image.get_width(), self.rect.y]
-        self.know4 = [self.rect.x, self.rect.y + self.image.get_height()]
+        # offsets of the front corners for the current image, see rotation_cache.Rotation
+        left_x, left_y = self.rotation.left_sensor
+        right_x, right_y = self.rotation.right_sensor
+        self.left_sensor = [self.rect.x + left_x, self.rect.y + left_y]
+        self.right_sensor = [self.rect.x + right_x, self.rect.y + right_y]
+
+        self.know, self.know2, self.know3, self.know4 = [[self.rect.x + dx, self.rect.y + dy] for dx, dy in self.rotation.corners]
         # pygame.draw.circle(SCREEN, FUCSIA, self.left_sensor, 5)
         # pygame.draw.circle(SCREEN, FUCSIA, self.right_sensor, 5)
         
@@ -230,31 +272,17 @@ class Car(pygame.sprite.Sprite):
 
        
     
-    def radar(self, radar_angle):
-        length = 10
-        x = int(self.rect.center[0])
-        y = int(self.rect.center[1])
-       # print(x,y)
-        while not SCREEN.get_at((x, y)) == pygame.Color(2, 105, 31, 255) and length < 250:
-            #print(x,y)
-            length += 1
-            x = int(self.rect.center[0] + math.cos(math.radians(self.body_orientation + radar_angle)) * length)
-            if x < 50:
-                x = 50
-            y = int(self.rect.center[1] - math.sin(math.radians(self.body_orientation + radar_angle)) * length)
-            if y < 5:
-                y = 5
-            if y > SCREEN_HEIGHT-5:
-                y = SCREEN_HEIGHT-5
-        # Draw Radar
-        pygame.draw.line(SCREEN, YELLOW, self.rect.center, (x, y), 1)
-        pygame.draw.circle(SCREEN, BLUE, (x, y), 2)
+    def radar(self, walls):
+        center = [self.rect.center]
+        angles = self.body_orientation + sensors.RADAR_ANGLES[None, :]
+        lengths = sensors.radar_lengths(center, angles, walls)
+        ends, dists = sensors.beam_ends(center, angles, lengths, SCREEN_HEIGHT)
+        self.draw_radar(ends[0])
+        for radar_angle, dist in zip(sensors.RADAR_ANGLES, dists[0]):
+            self.radars.append([int(radar_angle), int(dist)])
 
-        dist = int(math.sqrt(math.pow(self.rect.center[0] - x, 2)
-                             + math.pow(self.rect.center[1] - y, 2)))
-
-        self.radars.append([radar_angle, dist])
-        #print(dist)
+    def draw_radar(self, ends):
+        draw_radar(self.rect.center, ends)
         
         
     
@@ -269,11 +297,12 @@ class Car(pygame.sprite.Sprite):
                 SCREEN.get_at((x_l, y_l)) == pygame.Color(2, 105, 31, 255)  or
                 SCREEN.get_at((x_r, y_r)) == pygame.Color(2, 105, 31, 255) or
                 ((self.rect.centerx > traf_l_pos - 55 ))) :
-            print((self.left_sensor[0], self.left_sensor[1]))
-            if (x_l < 50 or x_l < 50 or y_l < 10 or y_r < 10 or y_l > (SCREEN_HEIGHT - 15) or y_r > (SCREEN_HEIGHT - 15)):
-                print("BOUNDARIES")
-            elif(SCREEN.get_at((x_l, y_l)) == pygame.Color(2, 105, 31, 255)  or SCREEN.get_at((x_r, y_r)) == pygame.Color(2, 105, 31, 255)):
-                print("COLLISION")
+            if VERBOSITY >= 2:
+                print((self.left_sensor[0], self.left_sensor[1]))
+                if (x_l < 50 or x_l < 50 or y_l < 10 or y_r < 10 or y_l > (SCREEN_HEIGHT - 15) or y_r > (SCREEN_HEIGHT - 15)):
+                    print("BOUNDARIES")
+                elif(SCREEN.get_at((x_l, y_l)) == pygame.Color(2, 105, 31, 255)  or SCREEN.get_at((x_r, y_r)) == pygame.Color(2, 105, 31, 255)):
+                    print("COLLISION")
             
                 
             return True
@@ -283,7 +312,8 @@ class Car(pygame.sprite.Sprite):
         else:
             self.still = 0
         if self.still >= 30 and self.rect.centerx < 200:
-            print("Too slow")
+            if VERBOSITY >= 2:
+                print("Too slow")
             return True
         if self.still >= 100 and self.rect.centerx >= 200:
             return True
@@ -296,7 +326,7 @@ class Car(pygame.sprite.Sprite):
     #     else:
     #         return False
     
-    def update(self):
+    def update(self, walls=None):
         
         self.draw_sensors()
         self.input_analisys()
@@ -304,9 +334,8 @@ class Car(pygame.sprite.Sprite):
         #self.crashed = self.detect_collision()
        # self.finish_line = self.detect_finishline()
         self.radars.clear()
-        angles = [-60, -30, 0, 30, 60]
-        for i in range(len(angles)):
-            self.radar(angles[i])
+        if walls is not None: # the trainer senses all the cars at once with sensors.radar_matrix
+            self.radar(walls)
         
        
     def draw(self, SCREEN):
@@ -333,49 +362,335 @@ class Car(pygame.sprite.Sprite):
        
        
         
-def remove(index):
-    cars.pop(index)
-    ge.pop(index)
-    nets.pop(index)
+def draw_radar(center, ends):
+    for x, y in ends.tolist():
+        # Draw Radar
+        pygame.draw.line(SCREEN, YELLOW, center, (x, y), 1)
+        pygame.draw.circle(SCREEN, BLUE, (x, y), 2)
+
+
+def commands(outputs):
+    """Turns the (N, 2) network outputs into the w, a, d, s commands of the cars."""
+    command = np.zeros((len(outputs), 4), dtype=int)
+    command[:, 0] = outputs[:, 0] > 0.7
+    command[:, 3] = outputs[:, 0] <= 0.7
+    command[:, 1] = outputs[:, 1] > 0.7
+    command[:, 2] = outputs[:, 1] <= 0.4
+    return command
+
+
+def detect_collisions(batch, live, walls, traf_l_pos):
+    """Car.detect_collision for the live cars of batch, updating batch.still.
+
+    walls is the boolean wall mask of the track, see Road.wall_mask, and
+    traf_l_pos the screen x of its red light. Returns the Crash cause of every
+    live car, Crash.NONE if it is still driving.
+    """
+    x_l, y_l = batch.left_sensor[live].astype(int).T
+    x_r, y_r = batch.right_sensor[live].astype(int).T
+    centerx = batch.centerx()[live]
+    boundaries = ((x_l < 50) | (y_l < 10) | (y_r < 10) |
+                  (y_l > (SCREEN_HEIGHT - 15)) | (y_r > (SCREEN_HEIGHT - 15)))
+    w, h = walls.shape
+    collision = ~boundaries & (walls[np.clip(x_l, 0, w - 1), np.clip(y_l, 0, h - 1)] |
+                               walls[np.clip(x_r, 0, w - 1), np.clip(y_r, 0, h - 1)])
+    red_light = ~boundaries & ~collision & (centerx > traf_l_pos - 55)
+    cause = np.select([boundaries, collision, red_light], [Crash.BOUNDARIES, Crash.COLLISION, Crash.RED_LIGHT], Crash.NONE)
+    if VERBOSITY >= 2:
+        for i in np.flatnonzero(cause):
+            print((batch.left_sensor[live[i], 0], batch.left_sensor[live[i], 1]))
+            if boundaries[i]:
+                print("BOUNDARIES")
+            elif collision[i]:
+                print("COLLISION")
+
+    driving = cause == Crash.NONE
+    still = batch.still[live]
+    stopped = (batch.x_velocity[live] == 0) & (batch.y_velocity[live] == 0) & ((traf_l_pos - centerx) > 200)
+    still = np.where(driving, np.where(stopped, still + 1, 0), still)
+    batch.still[live] = still
+    too_slow = driving & (still >= 30) & (centerx < 200)
+    if VERBOSITY >= 2:
+        for i in np.flatnonzero(too_slow):
+            print("Too slow")
+    cause[too_slow] = Crash.TOO_SLOW
+    cause[driving & (still >= 100) & (centerx >= 200)] = Crash.STALLED
+    return cause
+
+
+
+def spectated(live, fitness):
+    """The live cars to draw: all of them, or the SPECTATE with the highest fitness."""
+    if SPECTATE is None or len(live) <= SPECTATE:
+        return live
+    if SPECTATE == 0:
+        return live[:0]
+    return live[np.argpartition(fitness[live], -SPECTATE)[-SPECTATE:]]
+
+
+def take_generation_stats():
+    """Returns the TickStats gathered since the last call and starts new ones."""
+    global generation_stats
+    stats, generation_stats = generation_stats, telemetry.TickStats()
+    return stats
+
+
+def load_tracks(path):
+    """Streams the episodes' tracks from the library at path, None goes back to random tracks."""
+    global TRACK_LIBRARY
+    TRACK_LIBRARY = tracks.load(path) if path is not None else None
+
+
+def new_track(index=None, rng=random):
+    """The track of an episode, with its traffic light.
+
+    With a library loaded it is the track at index, by default the one of the
+    current generation. Otherwise it is drawn from rng.
+    """
+    if TRACK_LIBRARY is None:
+        return random_track(rng)
+    if index is None:
+        index = pop.generation
+    return start_track(tracks.LibraryRoad(TRACK_LIBRARY[index % len(TRACK_LIBRARY)]))
+
+
+def random_track(rng=random):
+    """A track drawn from rng, with its traffic light, whatever library is loaded."""
+    return start_track(road.Road(rng=rng))
+
+
+def start_track(trak):
+    """Lays the first points of trak and its traffic light."""
+    for i in range(12):
+        trak.addpoint()
+    trak.set_light(tracks.LIGHT_INDEX, 1)
+    return trak
+
+
+def new_tracks(count, index=None):
+    """The count tracks of an episode, see new_track.
+
+    A single track is new_track's own. Several come from consecutive library
+    indices, count per generation, or each from a seed drawn from the random
+    module.
+    """
+    if count == 1:
+        return [new_track(index)]
+    if TRACK_LIBRARY is not None:
+        first = (pop.generation if index is None else index) * count
+        return [new_track(first + k) for k in range(count)]
+    return [new_track(rng=random.Random(random.getrandbits(32))) for k in range(count)]
+
+
+def aggregate(fitness):
+    """Folds the (tracks, genomes) fitness of an episode into one per genome, see AGGREGATE."""
+    if AGGREGATE == 'mean':
+        return fitness.mean(axis=0)
+    if AGGREGATE == 'min':
+        return fitness.min(axis=0)
+    return np.quantile(fitness, AGGREGATE, axis=0)
+
+
+class CarEnv:
+    """Vectorized grid-track environment: num_cars cars on each of num_tracks tracks.
+
+    It follows the Gymnasium vector API without depending on it. reset(seed)
+    and step(actions) work on num_envs slots at once, slot j * num_cars + c
+    for car c on track j. Observations are the (num_envs, NUM_INPUTS) radar
+    distances and traffic light flags, actions the (num_envs, 4) w, a, d, s
+    commands, and rewards the fitness eval_genomes gives a car per tick,
+    summed up in returns. A slot leaves the episode when it is terminated by
+    a crash or truncated by termination, a TerminationPolicy; the episode is
+    over when live is empty. Nothing is drawn.
+    """
+    REWARD = 1  # fitness of a tick driven, or waited at a red light
+    # most fitness a tick can earn: the reward, plus the light's 0.1 * x_velocity penalty driving backwards
+    MAX_REWARD = REWARD * (1 + 0.1 * MAX_VELOCITY)
+
+    def __init__(self, num_cars, num_tracks=1, termination=None):
+        self.num_cars = num_cars
+        self.num_tracks = num_tracks
+        self.num_envs = num_cars * num_tracks
+        self.termination = termination
+        self.track_of = np.repeat(np.arange(num_tracks), num_cars)
+
+    def reset(self, seed=None, roads=None):
+        """Starts an episode on roads, by default num_tracks tracks drawn from seed.
+
+        Without a seed they are drawn from the random module, see new_tracks.
+        Returns the observations and an info dict.
+        """
+        if roads is None:
+            rng = random.Random(seed) if seed is not None else random
+            if self.num_tracks == 1:
+                roads = [random_track(rng)]
+            else:
+                roads = [random_track(random.Random(rng.getrandbits(32))) for j in range(self.num_tracks)]
+        self.roads = roads
+        self.batch = CarBatch(self.num_envs, car_image())
+        self.inputs = np.zeros((self.num_envs, sensors.NUM_INPUTS))
+        self.returns = np.zeros(self.num_envs)
+        self.shifts = np.zeros(self.num_tracks, dtype=int)
+        self.lights = np.full(self.num_tracks, 2000)
+        self.countdown = np.zeros(self.num_tracks, dtype=bool)
+        self.redlight_time = np.zeros(self.num_tracks, dtype=int)
+        self.tick = 1
+        # wall time per phase of the tick and crash causes, see telemetry
+        self.stats = telemetry.TickStats()
+        if self.termination is not None:
+            self.termination.start(self.num_envs)
+        self.stats.start()
+        self._open_tick()
+        return self.inputs.copy(), {}
+
+    def _open_tick(self):
+        """Traffic lights, rewards and crashed cars leaving, at the start of a tick.
+
+        Returns the rewards of the tick.
+        """
+        batch = self.batch
+        for j, track in enumerate(self.roads):
+            if self.countdown[j]:
+                self.redlight_time[j] += 1
+            if self.redlight_time[j] > 500:
+                self.countdown[j] = False
+                self.redlight_time[j] = 0
+                red = np.flatnonzero(track.light[:10] == 1)
+                if len(red):
+                    track.change_traf(red[0])
+                    if VERBOSITY >= 2:
+                        print("GREEN LIGHT!")
+            red = np.flatnonzero(track.light[:10] == 1)
+            if len(red):
+                self.lights[j] = track.screen_x(red[0])
+                self.countdown[j] = True
+            else:
+                self.lights[j] = 2000
+        light_x = self.lights[self.track_of]
+        self.stats.lap('traffic_light')
+
+        live = np.flatnonzero(batch.alive)
+        gap = light_x[live] - batch.centerx()[live]
+        x_velocity = batch.x_velocity[live]
+        at_light = (gap < 200) & (gap > 0)
+        penalty = np.where(at_light, self.REWARD*x_velocity*0.1, 0)
+        bonus = np.where(np.where(at_light, x_velocity <= 1, x_velocity > 1), self.REWARD, 0)
+        self.returns[live] -= penalty
+        self.returns[live] += bonus
+        reward = np.zeros(self.num_envs)
+        reward[live] = bonus - penalty
+
+        batch.alive[live[batch.crashed[live]]] = False
+        live = np.flatnonzero(batch.alive)
+        batch.finish_portion[live[batch.x[live] >= 1100]] = True
+        self.live = live
+        sensors.traffic_flags(batch.left_sensor[:, 0], light_x, self.inputs)
+        self.stats.lap('fitness')
+        return reward
+
+    def step(self, actions):
+        """Drives the live cars one tick with their rows of actions.
+
+        Returns the observations, rewards, terminations and truncations of
+        every slot, and an info dict: the Crash cause of every slot in
+        'crash', the cars that drove the tick in 'live' and their radar beam
+        end points in 'ends'.
+        """
+        batch, live, n = self.batch, self.live, self.num_cars
+        batch.command[live] = np.asarray(actions)[live]
+        # live[parts[j]:parts[j + 1]] are the live cars on track j
+        parts = np.searchsorted(live, np.arange(self.num_tracks + 1) * n)
+
+        for j, track in enumerate(self.roads):
+            on_track = live[parts[j]:parts[j + 1]]
+            if len(on_track) > 0 and batch.finish_portion[on_track].all():
+                slots = slice(j * n, (j + 1) * n)
+                track.shift()
+                batch.shift(road.SHIFT_LENGTH, slots)
+                batch.crashed[slots] = False
+                batch.finish_portion[slots] = False
+                self.shifts[j] += 1
+        self.stats.lap('shift')
+
+        batch.rot_center()
+        batch.update()
+        self.stats.lap('move')
 
+        centers = batch.center()[live]
+        orientations = batch.body_orientation[live]
+        sensed = self.inputs[live]
+        ends = np.empty((len(live), len(sensors.RADAR_ANGLES), 2), dtype=int)
+        for j, track in enumerate(self.roads):
+            part = slice(parts[j], parts[j + 1])
+            ends[part] = sensors.radar_matrix(centers[part], orientations[part], track.walls(), SCREEN_HEIGHT,
+                                              sensed[part])
+        self.inputs[live] = sensed
+        self.stats.lap('sensing')
+
+        for j, track in enumerate(self.roads):
+            on_track = live[parts[j]:parts[j + 1]]
+            batch.crash_cause[on_track] = detect_collisions(batch, on_track,
+                                                            track.wall_mask(SCREEN_WIDTH, SCREEN_HEIGHT),
+                                                            self.lights[j])
+        if self.termination is not None:
+            progress = batch.centerx()[live] + self.shifts[self.track_of[live]] * road.SHIFT_LENGTH
+            driving = batch.crash_cause[live] == Crash.NONE
+            # held at the end of the portion, or stopped where the light rewards stopping
+            gap = self.lights[self.track_of[live]] - batch.centerx()[live]
+            waiting = batch.finish_portion[live] | ((gap < 200) & (gap > 0) & (batch.x_velocity[live] <= 1))
+            ended = self.termination.check(self.tick, live, progress, self.returns, self.MAX_REWARD, waiting)
+            batch.crash_cause[live[driving]] = ended[driving]
+        cause = batch.crash_cause[live]
+        batch.crashed[live] = cause != Crash.NONE
+        self.stats.count_crashes(cause)
+        terminated = np.zeros(self.num_envs, dtype=bool)
+        truncated = np.zeros(self.num_envs, dtype=bool)
+        # the causes from TICK_BUDGET on are the termination policy's
+        terminated[live] = (cause != Crash.NONE) & (cause < Crash.TICK_BUDGET)
+        truncated[live] = cause >= Crash.TICK_BUDGET
+        self.stats.lap('collision')
+
+        info = {'crash': batch.crash_cause.copy(), 'live': live, 'ends': ends}
+        self.tick += 1
+        reward = self._open_tick()
+        return self.inputs.copy(), reward, terminated, truncated, info
 
 
 def eval_genomes(genomes, config):
     clock = pygame.time.Clock()
    # clock = pygame.time.Clock()
-    fit = 1
-    global cars, ge, nets, shifts
-    
-    shifts = 0
+    global batch, cars, ge, nets, shifts, inputs, episode_ticks, episode_stats
     
+    ge = []
+    # the first track is the one drawn and recorded
+    roads = new_tracks(EPISODE_TRACKS, track_index)
+    trak = roads[0]
+    n, k = len(genomes), len(roads)
+
     global traf_l_pos 
     traf_l_pos = 2000
 
-    cars = []
-    ge = []
-    nets = []
-    trak = road.Road()
-    SCREEN.fill((170,170,170))
-    
-    check = 0
-    next_lane = False
-    for i in range(12):
-        trak.addpoint()
-        
-    trak.points[5] = (trak.points[5][0], trak.points[5][1], 1 )    
+    if not HEADLESS:
+        SCREEN.fill((170,170,170))
     
     # LOADING SAVED GENOME!
-    # file = open("winner.p",'rb')   
-    # winner_genome = pickle.load(file)
-    # file.close()
+    # winner_genome = hall_of_fame.load("hall_of_fame.hof")
    
     
+    # one slot per genome and track, slot j * n + g for genome g on track j:
+    # kinematics, network inputs and fitness live in the environment
+    env = CarEnv(n, k, TERMINATION)
+    inputs, info = env.reset(roads=roads)
+    batch = env.batch
+    cars = batch.views()
+    shifts = env.shifts
+    fitness = env.returns
+    
     for genome_id, genome in genomes:
-        cars.append(pygame.sprite.GroupSingle(Car()))
         ge.append(genome)
-        net = neat.nn.FeedForwardNetwork.create(genome, config)
-        nets.append(net)
         genome.fitness = 0
+    # every network of the generation, once per track, evaluated together
+    nets = BatchNetwork(genomes, config, PROGRAMS).tile(k)
         
     # LOADING SAVED GENOME   
     # cars.append(pygame.sprite.GroupSingle(Car())) 
@@ -386,17 +701,21 @@ def eval_genomes(genomes, config):
     
     def score():
         global shifts
-        text = FONT.render(f'Driven sections:  {str(shifts)}', True, (0, 0, 0))
+        text = FONT.render(f'Driven sections:  {str(shifts.sum())}', True, (0, 0, 0))
         SCREEN.blit(text, (50, 620))
     
-    def statistics():
-        global cars, ge
-        text_1 = FONT.render(f'Cars Alive:  {str(len(cars))}', True, (0, 0, 0))
+    def statistics(shown):
+        global batch, ge
+        alive = np.count_nonzero(batch.alive)
+        text_1 = FONT.render(f'Cars Alive:  {str(alive)}', True, (0, 0, 0))
         text_2 = FONT.render(f'Generation:  {pop.generation+1}', True, (0, 0, 0))
         #text_3 = FONT.render(f'Game Speed:  {str(game_speed)}', True, (0, 0, 0))
 
         SCREEN.blit(text_1, (50, 640))
         SCREEN.blit(text_2, (50, 660))
+        if alive > len(shown):
+            text_4 = FONT.render(f'Not shown:  {str(alive - len(shown))}', True, (0, 0, 0))
+            SCREEN.blit(text_4, (50, 680))
         #SCREEN.blit(text_3, (50, 510))
     
     
@@ -406,42 +725,30 @@ def eval_genomes(genomes, config):
    # command = [0,0,0,0]
     run = True
    # command = [0,0,0,0]
-    countdown = False
-    redlight_time = 0
+    # wall time per phase of the tick and crash causes, see telemetry
+    episode_stats = stats = env.stats
+    recorder = replay.Recorder(RECORD_DIR, pop.generation, [genome_id for genome_id, genome in genomes]) \
+        if RECORD_DIR is not None else None
+    next_frame = 0.0
     while True:
         time += 1
+        # physics, sensing and fitness run every tick, drawing only on rendered ones
+        if HEADLESS:
+            render = False
+        elif RENDER_FPS is not None:
+            render = perf_counter() >= next_frame
+            if render:
+                next_frame = perf_counter() + 1 / RENDER_FPS
+        else:
+            render = time % RENDER_EVERY == 0
         #print(mycar.x_velocity)
-        SCREEN.fill((100,100,100))
-        #print(traf_l_pos)
-        if countdown:
-            redlight_time += 1
-        if redlight_time > 500:
-            countdown = False
-            redlight_time = 0
-            for i in range(10):
-                if trak.points[i][2] == 1:
-                   #trak.points[i][2] = 2
-                   trak.change_traf(i)
-                   print("GREEN LIGHT!")
-                   break
-               
-        for i in range(10): # INGLOBA IN QUELLO SOTTO
-            #print(trak.points[i][2])
-            if trak.points[i][2] == 1:
-                traf_l_pos = trak.points[i][0]
-                countdown = True
-                break
-            else:
-                traf_l_pos = 2000
-            
-        
         
-        
-        
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
+        if render:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    sys.exit()
+            stats.lap('rotate_draw')
             
             
                
@@ -467,132 +774,278 @@ def eval_genomes(genomes, config):
             #     if event.key == pygame.K_s:
             #         mycar.command[3] = 0
        
-        if len(cars) == 1:
-            #print(ge[0].fitness)
-            with open("Winner.p", "wb") as f:
-                pickle.dump(genomes[0], f)
-                f.close()
-            
-        if len(cars) == 0:
-            SCORES.append(shifts)
+        if len(env.live) == 0:
+            SCORES.append(int(shifts.sum()))
             #print("fin")
-            print(SCORES)
+            if VERBOSITY >= 2:
+                print(SCORES)
             break
         
-        for i, car in enumerate(cars):
-            
-            if ((traf_l_pos - car.sprite.rect.centerx) < 200 and ((traf_l_pos - car.sprite.rect.centerx) > 0)):
-                # if car.sprite.x_velocity > 1:
-                #     ge[i].fitness -= fit
-                # else:
-                #     ge[i].fitness += fit*3
-                ge[i].fitness -= fit*car.sprite.x_velocity*0.1
-                if car.sprite.x_velocity <= 1:
-                    #pygame.draw.circle(SCREEN, (255,80,100,100), (car.sprite.rect.centerx, 690), 2)
-                    ge[i].fitness += fit
-            elif car.sprite.x_velocity > 1:
-                ge[i].fitness += fit
-               # pygame.draw.circle(SCREEN, (255,0,255,255), (car.sprite.rect.centerx, 650), 2)
-           
-            if car.sprite.crashed:
-                #ge[i].fitness -= 0.5
-               
-                remove(i)
-            # if car.sprite.finish_line:
-            #     if(fit == 1):
-            #         ge[i].fitness += 5
-            #         print("LAP TIME:", time)
-            #         fit = 0
-            #     remove(i)
+        actions = commands(nets.activate(inputs))
+        stats.lap('inference')
+        inputs, rewards, terminated, truncated, info = env.step(actions)
+        traf_l_pos = env.lights[0]
+        # the cars of the drawn track that drove this tick
+        live = info['live']
+        live = live[live < n]
             
-            
-            if car.sprite.rect.x >= 1100:               
-                car.sprite.finish_portion = True
-                # car.sprite.shift()
-                # trak.shift()
-                # car.sprite.crashed = False
-                
-        for i, car in enumerate(cars):
-           output = nets[i].activate(car.sprite.data())
-           if output[0] > 0.7:
-               car.sprite.command[0] = 1
-               car.sprite.command[3] = 0
-           if output[1] > 0.7:
-               car.sprite.command[1] = 1
-               car.sprite.command[2] = 0
-           if output[0] <= 0.7:
-               car.sprite.command[3] = 1
-               car.sprite.command[0] = 0
-           if output[1] <= 0.4:
-               car.sprite.command[2] = 1
-               car.sprite.command[1] = 0
-           if output[1] > 0.4 and output[1] <= 0.7:
-               car.sprite.command[2] = 0
-               car.sprite.command[1] = 0
-        
-        check = 0
-        for i, car in enumerate(cars):
-            if car.sprite.finish_portion == True:
-                check += 1
-            else:
-                break
-            if check == len(cars):
-                next_lane = True
-                check = 0
-        
-        if next_lane == True:
-            next_lane = False
-            #print("ole")
-            trak.shift()
-            for i, car in enumerate(cars):
-                car.sprite.shift()
-                car.sprite.crashed = False
-                car.sprite.finish_portion = False
-            shifts += 1
-            
-        for i in range(len(trak.points)):
-            trak.draw(i)
-        
-        for car in cars:
-            car.sprite.rot_center(car.sprite.image_ori, car.sprite.body_orientation, car.sprite.rect.centerx, car.sprite.rect.centery)
-            car.draw(SCREEN)            
-            car.update()
-            
-        
-            
-        clock.tick(SPEED)
-        statistics()
-        score()
-        pygame.display.update()
-        
-        for car in cars:
-            car.sprite.crashed = car.sprite.detect_collision()
+        if render:
+            SCREEN.fill((100,100,100))
+            for i in range(len(trak)):
+                trak.draw(i)
+            shown = spectated(live, fitness)
+            for i in shown:
+                cars[i].draw(SCREEN)
+            drawn = np.isin(info['live'], shown)
+            for center, car_ends in zip(batch.center()[info['live'][drawn]].tolist(), info['ends'][drawn]):
+                draw_radar(center, car_ends)
+            if RENDER_FPS is None:
+                clock.tick(SPEED)
+            statistics(shown)
+            score()
+            pygame.display.update()
+            stats.lap('rotate_draw')
 
+        if recorder is not None:
+            recorder.record_track(time, trak)
+            recorder.record(time, batch, live, inputs[live, :sensors.TRAFFIC_COLUMN])
+            stats.lap('record')
 
+    if recorder is not None:
+        recorder.close()
+    episode_ticks = time
+    stats.episodes = 1
+    stats.ticks = time
+    stats.shifts = int(shifts.sum())
+    generation_stats.merge(stats)
+    for genome, genome_fitness in zip(ge, aggregate(fitness.reshape(k, n)).tolist()):
+        genome.fitness = genome_fitness
 
-def run(config_path):
-    global pop
-    config = neat.config.Config(
-        neat.DefaultGenome,
-        neat.DefaultReproduction,
-        neat.DefaultSpeciesSet,
-        neat.DefaultStagnation,
-        config_path
-    )
 
-    pop = neat.Population(config)
+
+def eval_genome(genome, config, track):
+    """Fitness and TickStats of genome driving alone, headless, on its EPISODE_TRACKS tracks.
+
+    track is the library index of the track, or the seed it is generated from
+    when no library is loaded, see new_tracks.
+    """
+    global HEADLESS, track_index
+    HEADLESS = True
+    if TRACK_LIBRARY is None:
+        random.seed(track)
+    else:
+        track_index = track
+    eval_genomes([(None, genome)], config)
+    return genome.fitness, episode_stats
+
+
+def init_worker(tracks_path, verbosity, termination, episode_tracks, aggregate):
+    global VERBOSITY, TERMINATION, EPISODE_TRACKS, AGGREGATE, RECORD_DIR
+    VERBOSITY = verbosity
+    RECORD_DIR = None  # a forked worker would record every episode as its fork-time generation
+    TERMINATION = termination
+    EPISODE_TRACKS = episode_tracks
+    AGGREGATE = aggregate
+    load_tracks(tracks_path)
+
+
+class ParallelEvaluator:
+    """Runs an independent eval_genome episode per genome on a pool of worker processes.
+
+    All the genomes of a generation drive on the same tracks, generated from a
+    seed drawn in the main process, so a seeded run stays reproducible. With a
+    track library every worker maps the same file and reads the generation's
+    tracks from it.
+    """
+    def __init__(self, workers, tracks_path=None):
+        self.workers = workers
+        self.pool = multiprocessing.Pool(workers, initializer=init_worker,
+                                         initargs=(tracks_path, VERBOSITY, TERMINATION, EPISODE_TRACKS, AGGREGATE))
+
+    def __del__(self):
+        self.pool.close()
+        self.pool.join()
+
+    def evaluate(self, genomes, config):
+        track = pop.generation if TRACK_LIBRARY is not None else random.getrandbits(32)
+        chunksize = max(1, len(genomes) // (self.workers * 4))
+        jobs = [(genome, config, track) for genome_id, genome in genomes]
+        for (genome_id, genome), (fitness, stats) in zip(genomes, self.pool.starmap(eval_genome, jobs, chunksize)):
+            genome.fitness = fitness
+            generation_stats.merge(stats)
+
+
+def run(config_path, headless=False, seed=None, workers=None, resume=None,
+        checkpoint_every=None, checkpoint_seconds=None, checkpoint_prefix='neat-checkpoint-',
+        hall_of_fame_path='hall_of_fame.hof', hall_of_fame_size=10, tracks_path=None,
+        verbosity=1, telemetry_path=None, render_every=1, render_fps=None, spectate=None,
+        record_dir=None, termination=None, episode_tracks=1, aggregate='mean'):
+    """Trains the population on config_path.
+
+    headless runs the same simulation on an off-screen surface, without window,
+    HUD or frame-rate cap. seed makes the tracks and the evolution reproducible.
+    workers evaluates the genomes one by one on that many processes instead of
+    all together in this one (always headless).
+
+    resume continues from a checkpoint file instead, with the config and
+    random state saved in it. checkpoint_every and checkpoint_seconds save one
+    every that many generations or seconds, named checkpoint_prefix plus the
+    generation it resumes at.
+
+    The hall_of_fame_size best genomes of the run are kept in
+    hall_of_fame_path, see hall_of_fame.load. A resumed run carries on with
+    what the file holds, any other run overwrites it.
+
+    tracks_path is a library built by tracks.py. Generation g then drives on
+    its track g instead of a random one.
+
+    verbosity sets VERBOSITY. The telemetry of every generation is also
+    appended to telemetry_path as JSON lines, see telemetry.
+
+    With a window, the simulation runs every tick but only every render_every-th
+    tick is drawn, and the SPEED frame-rate cap applies to those only. With
+    render_fps the frames are drawn at that wall-clock rate instead and the
+    simulation is not capped. spectate only draws the cars, and their radar,
+    with the spectate highest fitnesses, and counts the others on the HUD.
+
+    record_dir keeps a replay of every generation's episode there, see
+    replay.py to play them back. Episodes run by workers are not recorded.
+
+    termination is a TerminationPolicy bounding the length of the episodes.
+
+    episode_tracks runs every genome on that many tracks at once, as that many
+    cars in the same batch, and its fitness is their aggregate: 'mean', 'min'
+    or a quantile. Only the first track is drawn and recorded.
+    """
+    global pop, HEADLESS, VERBOSITY, RENDER_EVERY, RENDER_FPS, SPECTATE, RECORD_DIR, TERMINATION, \
+        EPISODE_TRACKS, AGGREGATE
+    if termination is not None and termination.stop_when_decided and episode_tracks > 1:
+        raise ValueError("stop_when_decided compares single-track fitnesses, not aggregates")
+    HEADLESS = headless
+    VERBOSITY = verbosity
+    RENDER_EVERY = render_every
+    RENDER_FPS = render_fps
+    SPECTATE = spectate
+    RECORD_DIR = record_dir
+    TERMINATION = termination
+    EPISODE_TRACKS = episode_tracks
+    AGGREGATE = aggregate
+    if seed is not None and resume is None:
+        random.seed(seed)
+    if not headless and not workers:
+        init_display()
+    load_tracks(tracks_path)
+
+    if resume is not None:
+        pop = checkpoint.restore(resume)
+    else:
+        config = neat.config.Config(
+            neat.DefaultGenome,
+            neat.DefaultReproduction,
+            neat.DefaultSpeciesSet,
+            neat.DefaultStagnation,
+            config_path
+        )
+        pop = neat.Population(config)
 
     # pop.add_reporter(neat.StdOutReporter(True))
     # stats = neat.StatisticsReporter()
     # pop.add_reporter(stats)
+    pop.add_reporter(hall_of_fame.HallOfFame(hall_of_fame_path, hall_of_fame_size, resume is not None))
+    pop.add_reporter(telemetry.TelemetryReporter(take_generation_stats, telemetry_path, verbosity))
+    if checkpoint_every is not None or checkpoint_seconds is not None:
+        pop.add_reporter(checkpoint.Checkpointer(pop, checkpoint_every, checkpoint_seconds, checkpoint_prefix))
     print("test")
-    pop.run(eval_genomes)
+    if workers:
+        evaluator = ParallelEvaluator(workers, tracks_path)
+        pop.run(evaluator.evaluate)
+    else:
+        pop.run(eval_genomes)
 
 
-if __name__ == '__main__':
-    local_dir = os.path.dirname(__file__)
-    config_path = os.path.join(local_dir, 'config.txt')
-    run(config_path)
+def parse_aggregate(text):
+    """An AGGREGATE from the command line: mean, min or a quantile between 0 and 1."""
+    if text in ('mean', 'min'):
+        return text
+    q = float(text)
+    if not 0 <= q <= 1:
+        raise ValueError("quantile outside [0, 1]: {0}".format(q))
+    return q
 
 
-        
+def positive_int(text):
+    """An integer option that must be at least 1."""
+    n = int(text)
+    if n < 1:
+        raise ValueError("not a positive integer: {0}".format(n))
+    return n
+
+
+def add_arguments(parser):
+    """Adds the options of the grid-track trainer to an argparse parser, see main."""
+    local_dir = os.path.dirname(os.path.abspath(__file__))
+    parser.add_argument("--config", default=os.path.join(local_dir, 'config.txt'))
+    parser.add_argument("--headless", action="store_true", help="no window, no rendering, no frame-rate cap")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="evaluate each genome alone in a pool of this many processes")
+    parser.add_argument("--resume", default=None, metavar="CHECKPOINT",
+                        help="continue from a checkpoint file, --config and --seed are ignored")
+    parser.add_argument("--checkpoint-every", type=int, default=None, metavar="GENERATIONS")
+    parser.add_argument("--checkpoint-seconds", type=float, default=None, metavar="SECONDS")
+    parser.add_argument("--checkpoint-prefix", default='neat-checkpoint-')
+    parser.add_argument("--hall-of-fame", default='hall_of_fame.hof', metavar="PATH",
+                        help="file keeping the best genomes of the run")
+    parser.add_argument("--hall-of-fame-size", type=positive_int, default=10, metavar="K")
+    parser.add_argument("--tracks", default=None, metavar="LIBRARY",
+                        help="drive generation g on track g of a library built by tracks.py")
+    parser.add_argument("--verbosity", type=int, default=1, choices=(0, 1, 2),
+                        help="0 silent, 1 telemetry per generation, 2 also every crash")
+    parser.add_argument("--telemetry", default=None, metavar="PATH",
+                        help="append the telemetry of every generation to this JSON lines file")
+    parser.add_argument("--render-every", type=positive_int, default=1, metavar="N",
+                        help="simulate every tick but draw only every Nth one")
+    parser.add_argument("--render-fps", type=float, default=None, metavar="FPS",
+                        help="draw at this wall-clock frame rate and simulate uncapped")
+    parser.add_argument("--spectate", type=positive_int, default=None, metavar="K",
+                        help="only draw the K live cars with the highest fitness")
+    parser.add_argument("--record", default=None, metavar="DIR",
+                        help="record every generation's episode for replay.py (not with --workers)")
+    parser.add_argument("--max-ticks", type=int, default=None, metavar="TICKS",
+                        help="end every episode after this many ticks")
+    parser.add_argument("--progress-window", type=int, default=None, metavar="TICKS",
+                        help="end a car that has not moved --min-progress along the track in this many ticks")
+    parser.add_argument("--min-progress", type=float, default=50, metavar="PIXELS")
+    parser.add_argument("--stop-when-decided", action="store_true",
+                        help="end the episode once no live car can beat the best fitness (needs --max-ticks)")
+    parser.add_argument("--tracks-per-genome", type=int, default=1, metavar="K",
+                        help="drive every genome on K tracks at once and aggregate its fitness")
+    parser.add_argument("--aggregate", type=parse_aggregate, default='mean', metavar="mean|min|QUANTILE",
+                        help="how the fitnesses of --tracks-per-genome fold into one")
+
+
+def main(args, parser):
+    """Trains with the options parser, set up by add_arguments, parsed into args."""
+    if args.stop_when_decided and args.max_ticks is None:
+        parser.error("--stop-when-decided needs --max-ticks")
+    if args.stop_when_decided and args.tracks_per_genome > 1:
+        parser.error("--stop-when-decided needs --tracks-per-genome 1")
+    termination = None
+    if args.max_ticks is not None or args.progress_window is not None or args.stop_when_decided:
+        termination = TerminationPolicy(args.max_ticks, args.progress_window, args.min_progress,
+                                        args.stop_when_decided)
+    run(args.config, headless=args.headless, seed=args.seed, workers=args.workers, resume=args.resume,
+        checkpoint_every=args.checkpoint_every, checkpoint_seconds=args.checkpoint_seconds,
+        checkpoint_prefix=args.checkpoint_prefix, hall_of_fame_path=args.hall_of_fame,
+        hall_of_fame_size=args.hall_of_fame_size, tracks_path=args.tracks,
+        verbosity=args.verbosity, telemetry_path=args.telemetry,
+        render_every=args.render_every, render_fps=args.render_fps, spectate=args.spectate,
+        record_dir=args.record, termination=termination, episode_tracks=args.tracks_per_genome,
+        aggregate=args.aggregate)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Train the NEAT cars on the grid track.")
+    add_arguments(parser)
+    main(parser.parse_args(), parser)
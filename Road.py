@@ -10,57 +10,169 @@ import os
 import random
 import math
 import sys
+import numpy as np
 
 SCREEN_WIDTH = 1500
 SCREEN_HEIGHT = 700
 
-SCREEN = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-TRACK = pygame.image.load(os.path.join("CarAssets", "track2.png"))
+# Drawing target, replaced by the trainer with its own screen
+SCREEN = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
 
 TRACK_WIDTH = 80
 TRACK_PIECE_LENGHT = 800
 TRAF_WIDTH = 15
+WALL_WIDTH = 22
+# band covered by a WALL_WIDTH pygame line, relative to its centre
+WALL_EDGES = (-WALL_WIDTH/2 + 0.5, WALL_WIDTH/2 + 0.5)
+SHIFT_POINTS = 5
+POINT_SPACING = 200
+SHIFT_LENGTH = SHIFT_POINTS * POINT_SPACING
+
 class Road:
-    def __init__(self):
-        self.points = [(0, SCREEN_HEIGHT/2, 0)]
-        
+    """Track centre line, kept in a ring buffer of world x, y and light state.
+
+    Every point is written twice, at i and i + capacity, so the live points
+    are always the contiguous slice [start, start + count) of each array and
+    x, y and light can hand out views without copying. x is in world space:
+    shift() drops the oldest points, adds new ones and moves the scroll
+    offset, without touching the points that stay.
+
+    New points are drawn from rng, the random module unless a seeded
+    random.Random is given (see tracks.generate).
+    """
+    def __init__(self, capacity=32, rng=random):
+        self.capacity = capacity
+        self.rng = rng
+        self._x = np.zeros(2 * capacity)
+        self._y = np.zeros(2 * capacity)
+        self._light = np.zeros(2 * capacity, dtype=int)
+        self._start = 0
+        self._count = 0
+        self.offset = 0  # world x of the screen's left edge
+        self._walls = None
+        self._mask = None
+        self._append(0, SCREEN_HEIGHT/2, 0)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def x(self):
+        return self._x[self._start:self._start + self._count]
+
+    @property
+    def y(self):
+        return self._y[self._start:self._start + self._count]
+
+    @property
+    def light(self):
+        return self._light[self._start:self._start + self._count]
+
+    @property
+    def points(self):
+        """The points as (screen x, y, light) tuples, a copy."""
+        return list(zip((self.x - self.offset).tolist(), self.y.tolist(), self.light.tolist()))
+
+    def screen_x(self, i):
+        return self._x[self._start + i] - self.offset
+
+    def _write(self, i, x, y, light):
+        pos = (self._start + i) % self.capacity
+        for p in (pos, pos + self.capacity):
+            self._x[p] = x
+            self._y[p] = y
+            self._light[p] = light
+
+    def _append(self, x, y, light):
+        if self._count == self.capacity:
+            self._grow()
+        self._write(self._count, x, y, light)
+        self._count += 1
+
+    def _grow(self):
+        count = self._count
+        kept = (self.x.copy(), self.y.copy(), self.light.copy())
+        self.capacity *= 2
+        self._x = np.zeros(2 * self.capacity)
+        self._y = np.zeros(2 * self.capacity)
+        self._light = np.zeros(2 * self.capacity, dtype=int)
+        self._start = 0
+        for array, values in zip((self._x, self._y, self._light), kept):
+            array[:count] = array[self.capacity:self.capacity + count] = values
+
     def addpoint(self):        
-        l = len(self.points)-1
+        self._walls = self._mask = None
+        l = self._count-1
         if l == 0:
             new_point_y = SCREEN_HEIGHT/2
         else:
-            last_point_y = self.points[l][1]
-            new_point_y = random.uniform(last_point_y-150, last_point_y+150)
+            last_point_y = self.y[l]
+            new_point_y = self.rng.uniform(last_point_y-150, last_point_y+150)
         if new_point_y > SCREEN_HEIGHT - TRACK_WIDTH-50:
             new_point_y = SCREEN_HEIGHT - TRACK_WIDTH-50
         if new_point_y < TRACK_WIDTH+50:
             new_point_y = TRACK_WIDTH+50
-        if random.uniform(0,20) == 21:
-            self.points.append((self.points[l][0]+200,new_point_y,1))
+        if self.rng.uniform(0,20) == 21:
+            self._append(self.x[l]+POINT_SPACING,new_point_y,1)
         else:
-            self.points.append((self.points[l][0]+200,new_point_y,0))
+            self._append(self.x[l]+POINT_SPACING,new_point_y,0)
         
     def draw(self,i):
-        #pygame.draw.circle(SCREEN, (0, 255, 110, 0), self.points[i], 3)
+        x1, y1 = self.screen_x(i), self.y[i]
+        #pygame.draw.circle(SCREEN, (0, 255, 110, 0), (x1, y1), 3)
         if (i > 0):
-            pygame.draw.line(SCREEN, (2, 105, 31, 255), (self.points[i-1][0], self.points[i-1][1]+TRACK_WIDTH), (self.points[i][0], self.points[i][1]+TRACK_WIDTH), 22)
-            pygame.draw.line(SCREEN, (2, 105, 31, 255), (self.points[i-1][0], self.points[i-1][1]-TRACK_WIDTH), (self.points[i][0], self.points[i][1]-TRACK_WIDTH), 22)
-        if (self.points[i][2] == 1):
-            pygame.draw.line(SCREEN, (255, 0, 0, 255), (self.points[i][0], self.points[i][1] + TRAF_WIDTH ), (self.points[i][0], self.points[i][1] - TRAF_WIDTH ), 5)
-        if (self.points[i][2] == 2):
-            pygame.draw.line(SCREEN, (0, 255, 0, 255), (self.points[i][0], self.points[i][1] + TRAF_WIDTH ), (self.points[i][0], self.points[i][1] - TRAF_WIDTH ), 5)
+            x0, y0 = self.screen_x(i-1), self.y[i-1]
+            pygame.draw.line(SCREEN, (2, 105, 31, 255), (x0, y0+TRACK_WIDTH), (x1, y1+TRACK_WIDTH), WALL_WIDTH)
+            pygame.draw.line(SCREEN, (2, 105, 31, 255), (x0, y0-TRACK_WIDTH), (x1, y1-TRACK_WIDTH), WALL_WIDTH)
+        if (self.light[i] == 1):
+            pygame.draw.line(SCREEN, (255, 0, 0, 255), (x1, y1 + TRAF_WIDTH ), (x1, y1 - TRAF_WIDTH ), 5)
+        if (self.light[i] == 2):
+            pygame.draw.line(SCREEN, (0, 255, 0, 255), (x1, y1 + TRAF_WIDTH ), (x1, y1 - TRAF_WIDTH ), 5)
     
     def shift(self):  
-        for h in range(5):
-            self.points.pop(0)
-        for i in range(5):
+        self._walls = self._mask = None
+        self._start = (self._start + SHIFT_POINTS) % self.capacity
+        self._count -= SHIFT_POINTS
+        for i in range(SHIFT_POINTS):
             self.addpoint()
-        for i in range(len(self.points)):
-            self.points[i] = (self.points[i][0] - 1000, self.points[i][1], self.points[i][2])
+        self.offset += SHIFT_LENGTH
     
+    def set_light(self, i, state):
+        self._write(i, self.x[i], self.y[i], state)
+
     def change_traf(self, i):
-         if (self.points[i][2] == 1):
-             self.points[i] = (self.points[i][0], self.points[i][1], 2)
+         if (self.light[i] == 1):
+             self.set_light(i, 2)
+
+    def walls(self):
+        """Returns the edges of the two walls drawn by draw() as (M, 4) x1, y1, x2, y2 segments."""
+        if self._walls is None:
+            xs = self.x - self.offset
+            x1, x2 = xs[:-1], xs[1:]
+            segments = []
+            for side in (-TRACK_WIDTH, TRACK_WIDTH):
+                for edge in WALL_EDGES:
+                    y = self.y + side + edge
+                    segments.append(np.column_stack((x1, y[:-1], x2, y[1:])))
+            self._walls = np.concatenate(segments)
+        return self._walls
+
+    def wall_mask(self, width, height):
+        """Returns a (width, height) boolean array, True on the pixels of the walls drawn by draw().
+
+        It is rasterized again only after the points change, not every frame.
+        """
+        if self._mask is None or self._mask.shape != (width, height):
+            xs = self.x - self.offset
+            columns = np.arange(width)
+            rows = np.arange(height)
+            centre = np.interp(columns, xs, self.y)[:, None]
+            mask = np.zeros((width, height), dtype=bool)
+            for side in (-TRACK_WIDTH, TRACK_WIDTH):
+                mask |= (rows >= centre + side + WALL_EDGES[0]) & (rows < centre + side + WALL_EDGES[1])
+            mask[(columns < xs[0]) | (columns > xs[-1])] = False
+            self._mask = mask
+        return self._mask
     
     
     
@@ -1,7 +1,11 @@
 import pygame
 import neat
 import os
+import sys
 import math
+import random
+import collections
+import numpy as np
 
 # Screen dimensions
 WIDTH, HEIGHT = 900, 600
@@ -21,12 +25,49 @@ BLACK = (0, 0, 0)         # Crayola Black
 AMPLITUDE = 100
 FREQUENCY = 0.02
 SHIFT_AMOUNT = 5
+POINT_SPACING = 5  # x distance between two road points
+BUCKET_WIDTH = 50  # x width of a SegmentBuckets cell
 
 # Car parameters
 CAR_RADIUS = 10
 CAR_X = WIDTH // 2 #Chase car is 1/2 of the screen away
 TARGET_CAR_OFFSET = WIDTH // 4 #Target car is 1/4 of the screen away
 
+class SegmentBuckets:
+    """Uniform x-grid over the segments of one road edge.
+
+    A segment sits in every bucket its x extent overlaps. Points only leave
+    the left end of a line and join its right end, so each bucket is a deque
+    kept in x order and updated at its ends.
+    """
+    def __init__(self, points):
+        self.buckets = {}
+        for p1, p2 in zip(points, points[1:]):
+            self.append(p1, p2)
+
+    def _cells(self, p1, p2):
+        return range(math.floor(p1[0] / BUCKET_WIDTH), math.floor(p2[0] / BUCKET_WIDTH) + 1)
+
+    def append(self, p1, p2):
+        for cell in self._cells(p1, p2):
+            self.buckets.setdefault(cell, collections.deque()).append((p1, p2))
+
+    def popleft(self, p1, p2):
+        for cell in self._cells(p1, p2):
+            bucket = self.buckets[cell]
+            bucket.popleft()
+            if not bucket:
+                del self.buckets[cell]
+
+    def query(self, min_x, max_x):
+        """Yields each segment of the buckets overlapping road x min_x to max_x once, in x order."""
+        first = math.floor(min_x / BUCKET_WIDTH)
+        for cell in range(first, math.floor(max_x / BUCKET_WIDTH) + 1):
+            for p1, p2 in self.buckets.get(cell, ()):
+                # a segment crossing a cell border is only yielded from its first cell
+                if cell == first or math.floor(p1[0] / BUCKET_WIDTH) == cell:
+                    yield p1, p2
+
 class Road:
     def __init__(self, amplitude, frequency, road_width=WIDTH):
         self.amplitude = amplitude
@@ -46,15 +87,27 @@ class Road:
         self.center_points = []
         self.top_points = []
         self.bottom_points = []
+        self._center_y = None  # array copy of the centre y for get_y_at_x
 
         # Generate road points with sine wave displacement
-        for x in range(0, WIDTH + self.road_width * 2, 5):  # Cover initial visible width and extra padding
+        for x in range(0, WIDTH + self.road_width * 2, POINT_SPACING):  # Cover initial visible width and extra padding
             center_y = HEIGHT // 2 + self.amplitude * math.sin(self.frequency * x)
 
             self.center_points.append((x, center_y))
             self.top_points.append((x, center_y - self.path_width // 2))
             self.bottom_points.append((x, center_y + self.path_width // 2))
 
+        self.top_index = SegmentBuckets(self.top_points)
+        self.bottom_index = SegmentBuckets(self.bottom_points)
+
+    def edge_index(self, points):
+        """Returns the SegmentBuckets of an edge line, None for the centre line."""
+        if points is self.top_points:
+            return self.top_index
+        if points is self.bottom_points:
+            return self.bottom_index
+        return None
+
     def draw(self, surface):
         """Draws the three road lines."""
         self.draw_line(surface, self.center_points, 3, RED)
@@ -74,6 +127,7 @@ class Road:
     def shift(self, shift_amount):
         """Shift all road lines and dynamically add/remove points."""
         self.x_offset += shift_amount
+        self._center_y = None
 
         self.shift_line(self.center_points)
         self.shift_line(self.top_points)
@@ -81,14 +135,18 @@ class Road:
 
     def shift_line(self, points):
         """Shift a single line of points and add/remove points as needed."""
+        index = self.edge_index(points)
+
         # Remove points that are off-screen to the left
         while points and points[0][0] < self.x_offset - 10:
+            if index is not None and len(points) > 1:
+                index.popleft(points[0], points[1])
             points.pop(0)
 
         # Add new points to the right to maintain continuity
         while points[-1][0] - self.x_offset < WIDTH + 10:
             last_x = points[-1][0]
-            new_x = last_x + 5
+            new_x = last_x + POINT_SPACING
 
             # Use the raw new_x for sine calculations directly
             new_y = HEIGHT // 2 + self.amplitude * math.sin(self.frequency * new_x)
@@ -105,19 +163,39 @@ class Road:
                 print("Error: points list not recognized")
 
             points.append((new_x, new_y))
+            if index is not None:
+                index.append(points[-2], points[-1])
             # print(f"last_x = {last_x}, new_x = {new_x}, new_y = {new_y}")
 
     def get_y_at_x(self, x):
-        """Returns the y-value of the sine wave at the given x."""
-        for i in range(len(self.center_points) -1):
-            if self.center_points[i][0] <= x <= self.center_points[i+1][0]:
-                x1 = self.center_points[i][0]
-                y1 = self.center_points[i][1]
-                x2 = self.center_points[i+1][0]
-                y2 = self.center_points[i+1][1]
-                slope = (y2-y1)/(x2-x1)
-                return y1 + slope*(x - x1)
-        return None
+        """Returns the y-value of the sine wave at the given x.
+
+        The centre points are POINT_SPACING apart, so the segment holding x is
+        found by index instead of a scan. x can also be a NumPy array, then an
+        array comes back with NaN where the plain call would return None.
+        """
+        if np.ndim(x):
+            return self._get_y_at_xs(np.asarray(x, dtype=float))
+        first_x = self.center_points[0][0]
+        if not first_x <= x <= self.center_points[-1][0]:
+            return None
+        i = max(math.ceil((x - first_x) / POINT_SPACING) - 1, 0)
+        x1, y1 = self.center_points[i]
+        x2, y2 = self.center_points[i+1]
+        slope = (y2-y1)/(x2-x1)
+        return y1 + slope*(x - x1)
+
+    def _get_y_at_xs(self, xs):
+        if self._center_y is None:
+            self._center_y = np.array([p[1] for p in self.center_points])
+        first_x = self.center_points[0][0]
+        on_road = (xs >= first_x) & (xs <= self.center_points[-1][0])
+        xs = np.where(on_road, xs, first_x)
+        i = np.maximum(np.ceil((xs - first_x) / POINT_SPACING).astype(int) - 1, 0)
+        y1 = self._center_y[i]
+        y2 = self._center_y[i+1]
+        slope = (y2-y1)/POINT_SPACING
+        return np.where(on_road, y1 + slope*(xs - (first_x + i*POINT_SPACING)), np.nan)
 class TargetCar: #New target car class
     def __init__(self, x, radius, color):
         self.x = x
@@ -200,8 +278,8 @@ class Car:  # Red car
                 ray_length += 1
 
                 # Check intersections
-                intersect_top = self.find_intersection(self.x, self.y, ray_x, ray_y, road.top_points, road.x_offset)
-                intersect_bottom = self.find_intersection(self.x, self.y, ray_x, ray_y, road.bottom_points, road.x_offset)
+                intersect_top = self.find_bucketed_intersection(self.x, self.y, ray_x, ray_y, road.top_index, road.x_offset)
+                intersect_bottom = self.find_bucketed_intersection(self.x, self.y, ray_x, ray_y, road.bottom_index, road.x_offset)
 
                 if intersect_top is not None:
                     dist = math.sqrt((intersect_top[0] - self.x) ** 2 + (intersect_top[1] - self.y) ** 2)
@@ -227,6 +305,28 @@ class Car:  # Red car
             pygame.draw.line(screen, GREEN, (self.x, self.y), (end_x, end_y), 1)
             pygame.draw.circle(screen, RED, (int(end_x), int(end_y)), 2)  # Mark intersection point
 
+    def find_bucketed_intersection(self, x1, y1, x2, y2, index, x_offset):
+        """find_intersection over the segments of a SegmentBuckets in the ray's x range."""
+        for p1, p2 in index.query(min(x1, x2) + x_offset, max(x1, x2) + x_offset):
+            x3 = p1[0] - x_offset
+            y3 = p1[1]
+            x4 = p2[0] - x_offset
+            y4 = p2[1]
+
+            denom = (y4 - y3) * (x2 - x1) - (x4 - x3) * (y2 - y1)
+            if denom == 0:
+                continue
+
+            ua = ((x4 - x3) * (y1 - y3) - (y4 - y3) * (x1 - x3)) / denom
+            ub = ((x2 - x1) * (y1 - y3) - (y2 - y1) * (x1 - x3)) / denom
+
+            if 0 <= ua <= 1 and 0 <= ub <= 1:
+                x = x1 + ua * (x2 - x1)
+                y = y1 + ua * (y2 - y1)
+                return x, y
+
+        return None
+
     def find_intersection(self, x1, y1, x2, y2, points, x_offset):
         # Calculate the x-range of interest
         min_x = min(x1, x2) - AMPLITUDE
@@ -296,43 +396,83 @@ class Car:  # Red car
         return None
 
 
-# Initialize Pygame
-pygame.init()
-
-#
-SCREEN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Scrolling Sine Road with Car")
-
-# Create a road object
-road = Road(AMPLITUDE, FREQUENCY)
-target_car = TargetCar(CAR_X + TARGET_CAR_OFFSET, CAR_RADIUS, CRAYOLA_BLUE)
-car = Car(CAR_X, CAR_RADIUS)
-# Game loop
-clock = pygame.time.Clock()
-running = True
-
-while running:
-    # Shift the road
-    road.shift(SHIFT_AMOUNT)
-
-    target_car.update(road, road.x_offset)  # Update the target car position
-    car.update_test(road, road.x_offset)  # Update the target car position
-    car.get_radar_data(road)
-
-    # Clear the screen
-    SCREEN.fill(BLACK)
-
-    # Draw the road, car, and target car
-    road.draw(SCREEN)
-    target_car.draw(SCREEN)
-    car.draw(SCREEN)
-
-    # Update the display
-    pygame.display.flip()
-
-    # Cap the frame rate
-    clock.tick(30)
-
-# Quit Pygame
-pygame.quit()
-sys.exit()
+def check_intersections(shifts=200, rays=20, seed=0):
+    """Compares find_bucketed_intersection with find_intersection and find_intersectionx.
+
+    Casts random rays over a scrolling road and counts, for each of the older
+    routines, the rays where it returns a different point. Returns the counts
+    as a dict.
+    """
+    rng = random.Random(seed)
+    road = Road(AMPLITUDE, FREQUENCY)
+    car = Car(CAR_X, CAR_RADIUS)
+    mismatches = {"find_intersection": 0, "find_intersectionx": 0}
+    for _ in range(shifts):
+        road.shift(rng.randint(1, 3 * SHIFT_AMOUNT))
+        for _ in range(rays):
+            x1, y1 = rng.uniform(0, WIDTH), rng.uniform(0, HEIGHT)
+            angle = rng.uniform(0, 2 * math.pi)
+            length = rng.uniform(1, 200)
+            x2, y2 = x1 + length * math.cos(angle), y1 + length * math.sin(angle)
+            for points, index in ((road.top_points, road.top_index), (road.bottom_points, road.bottom_index)):
+                expected = car.find_bucketed_intersection(x1, y1, x2, y2, index, road.x_offset)
+                for name in mismatches:
+                    if getattr(car, name)(x1, y1, x2, y2, points, road.x_offset) != expected:
+                        mismatches[name] += 1
+    return mismatches
+
+
+def main():
+    """Runs the scrolling road demo until the window is closed."""
+    # Initialize Pygame
+    pygame.init()
+
+    #
+    SCREEN = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Scrolling Sine Road with Car")
+
+    # Create a road object
+    road = Road(AMPLITUDE, FREQUENCY)
+    target_car = TargetCar(CAR_X + TARGET_CAR_OFFSET, CAR_RADIUS, CRAYOLA_BLUE)
+    car = Car(CAR_X, CAR_RADIUS)
+    # Game loop
+    clock = pygame.time.Clock()
+    running = True
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+
+        # Shift the road
+        road.shift(SHIFT_AMOUNT)
+
+        target_car.update(road, road.x_offset)  # Update the target car position
+        car.update_test(road, road.x_offset)  # Update the target car position
+        car.get_radar_data(road)
+
+        # Clear the screen
+        SCREEN.fill(BLACK)
+
+        # Draw the road, car, and target car
+        road.draw(SCREEN)
+        target_car.draw(SCREEN)
+        car.draw(SCREEN)
+
+        # Update the display
+        pygame.display.flip()
+
+        # Cap the frame rate
+        clock.tick(30)
+
+    # Quit Pygame
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    if "--check" in sys.argv:
+        mismatches = check_intersections()
+        for name, count in mismatches.items():
+            print(f"{name}: {count} rays disagree with the bucket index")
+        sys.exit(1 if mismatches["find_intersection"] else 0)
+    main()
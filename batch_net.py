@@ -0,0 +1,341 @@
+"""Population-wide inference for NEAT feed-forward genomes.
+
+compile_genome lowers a genome to a Program: its nodes in topological order
+with index-based links, evaluated one input at a time by Program.activate or
+many at once by Program.activate_batch. ProgramCache keeps the most recently
+used Programs by the structure and parameters of their genomes, so unchanged
+elites are not compiled again and a new genome with a known topology only has
+its parameters gathered.
+
+BatchNetwork lays the Programs of all the genomes of a generation out as one
+(genomes, nodes) value matrix and evaluates them layer by layer, all genomes
+at once.
+
+All of them sum the links of a node in the order
+neat.nn.FeedForwardNetwork.activate does. Program.activate returns the same
+floats as neat. The numpy paths are equal to it up to float rounding: numpy's
+exp, tanh and sin can differ from the math module's in the last bit, and
+their results can also depend on the length of the array.
+"""
+import collections
+import copy
+import itertools
+import math
+
+import numpy as np
+from neat.graphs import feed_forward_layers
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(5.0 * z, -60.0, 60.0)))
+
+
+def _inv(z):
+    with np.errstate(divide="ignore"):
+        return np.where(z == 0, 0.0, 1.0 / z)
+
+
+# numpy versions of neat's built-in activation functions
+ACTIVATIONS = {
+    'sigmoid': _sigmoid,
+    'tanh': lambda z: np.tanh(np.clip(2.5 * z, -60.0, 60.0)),
+    'sin': lambda z: np.sin(np.clip(5.0 * z, -60.0, 60.0)),
+    'gauss': lambda z: np.exp(-5.0 * np.clip(z, -3.4, 3.4)**2),
+    'relu': lambda z: np.where(z > 0.0, z, 0.0),
+    'softplus': lambda z: 0.2 * np.log(1 + np.exp(np.clip(5.0 * z, -60.0, 60.0))),
+    'identity': lambda z: z,
+    'clamped': lambda z: np.clip(z, -1.0, 1.0),
+    'inv': _inv,
+    'log': lambda z: np.log(np.maximum(z, 1e-7)),
+    'exp': lambda z: np.exp(np.clip(z, -60.0, 60.0)),
+    'abs': np.abs,
+    'hat': lambda z: np.maximum(0.0, 1 - np.abs(z)),
+    'square': lambda z: z**2,
+    'cube': lambda z: z**3,
+}
+# activation of a BatchNetwork node as an index into ACTIVATIONS, -1 when it has no numpy version
+ACTIVATION_CODES = {name: code for code, name in enumerate(ACTIVATIONS)}
+
+
+class _Layout:
+    """What a Program takes from the structure of its genome.
+
+    Value slot i holds input i, then come the outputs, then the hidden
+    nodes. The evaluated nodes are listed by depth, order[layers[d]:layers[d + 1]]
+    being those of depth d, and the links of node i come from the slots
+    link_src[link_start[i]:link_start[i + 1]]. node_index and link_index
+    locate the nodes and links in the genome's parameters, see _parameters.
+    Lists, not arrays: BatchNetwork converts a whole generation at once.
+    """
+
+    def __init__(self, genome, genome_config):
+        input_keys = list(genome_config.input_keys)
+        output_keys = list(genome_config.output_keys)
+        self.num_inputs = len(input_keys)
+        self.num_outputs = len(output_keys)
+        slots = {key: i for i, key in enumerate(input_keys + output_keys)}
+        for key in genome.nodes:
+            slots.setdefault(key, len(slots))
+        self.width = len(slots)
+
+        connections = [cg.key for cg in genome.connections.values() if cg.enabled]
+        incoming = collections.defaultdict(list)
+        for i, key in enumerate(connections):
+            incoming[key[1]].append(i)
+        self.order, self.depth, self.layers = [], [], [0]
+        self.link_index, self.link_start, self.link_dst = [], [0], []
+        for depth, layer in enumerate(feed_forward_layers(input_keys, output_keys, connections)):
+            for node in layer:
+                if genome.nodes[node].aggregation != 'sum':
+                    raise ValueError("only sum aggregation is supported, not {0!r}".format(genome.nodes[node].aggregation))
+                self.link_dst.extend([len(self.order)] * len(incoming[node]))
+                self.order.append(node)
+                self.depth.append(depth)
+                self.link_index.extend(incoming[node])
+                self.link_start.append(len(self.link_index))
+            self.layers.append(len(self.order))
+        node_position = {key: i for i, key in enumerate(genome.nodes)}
+        self.node_index = [node_position[node] for node in self.order]
+        self.slot = [slots[node] for node in self.order]
+        self.activations = [genome.nodes[node].activation for node in self.order]
+        self.codes = [ACTIVATION_CODES.get(name, -1) for name in self.activations]
+        self.activation_defs = genome_config.activation_defs
+        self.link_src = [slots[connections[i][0]] for i in self.link_index]
+
+
+class Program:
+    """A genome compiled by compile_genome."""
+
+    def __init__(self, layout, parameters):
+        self.layout = layout
+        nodes, weights = parameters
+        self.bias = [nodes[i][0] for i in layout.node_index]
+        self.response = [nodes[i][1] for i in layout.node_index]
+        self.weights = [weights[i] for i in layout.link_index]
+        self._steps = None
+
+    def steps(self):
+        """(slot, bias, response, activation or None for sigmoid, links) per node, built on first use."""
+        if self._steps is None:
+            layout = self.layout
+            src, start = layout.link_src, layout.link_start
+            functions = [None if name == 'sigmoid' else layout.activation_defs.get(name)
+                         for name in layout.activations]
+            self._steps = [(slot, bias, response, function,
+                            list(zip(src[start[i]:start[i + 1]], self.weights[start[i]:start[i + 1]])))
+                           for i, (slot, bias, response, function)
+                           in enumerate(zip(layout.slot, self.bias, self.response, functions))]
+        return self._steps
+
+    def activate(self, inputs):
+        """Evaluates the network on one input sequence, returns the outputs as a list."""
+        layout = self.layout
+        if len(inputs) != layout.num_inputs:
+            raise RuntimeError("Expected {0:n} inputs, got {1:n}".format(layout.num_inputs, len(inputs)))
+        values = [0.0] * layout.width
+        values[:layout.num_inputs] = inputs
+        for slot, bias, response, function, links in self.steps():
+            z = bias + response * sum([values[src] * weight for src, weight in links])
+            if function is None:
+                values[slot] = 1.0 / (1.0 + math.exp(-max(-60.0, min(60.0, 5.0 * z))))
+            else:
+                values[slot] = function(z)
+        return values[layout.num_inputs:layout.num_inputs + layout.num_outputs]
+
+    def activate_batch(self, inputs):
+        """Evaluates the network on every row of an (N, inputs) matrix, returns (N, outputs)."""
+        layout = self.layout
+        if np.shape(inputs)[1] != layout.num_inputs:
+            raise RuntimeError("Expected {0:n} inputs, got {1:n}".format(layout.num_inputs, np.shape(inputs)[1]))
+        rows = len(inputs)
+        values = np.zeros((rows, layout.width))
+        values[:, :layout.num_inputs] = inputs
+        slot, src, dst = np.array(layout.slot, dtype=int), np.array(layout.link_src, dtype=int), np.array(layout.link_dst, dtype=int)
+        bias, response, weights = np.array(self.bias), np.array(self.response), np.array(self.weights)
+        for first, last in zip(layout.layers, layout.layers[1:]):
+            links = slice(layout.link_start[first], layout.link_start[last])
+            terms = values[:, src[links]] * weights[links]
+            bins = ((dst[links] - first) + (last - first) * np.arange(rows)[:, None]).ravel()
+            s = np.bincount(bins, weights=terms.ravel(), minlength=rows * (last - first))
+            z = bias[first:last] + response[first:last] * s.reshape(rows, last - first)
+            for i, name in enumerate(layout.activations[first:last]):
+                values[:, slot[first + i]] = ACTIVATIONS[name](z[:, i])
+        return values[:, layout.num_inputs:layout.num_inputs + layout.num_outputs]
+
+
+def _structure(genome, genome_config):
+    """What the _Layout of genome depends on."""
+    return (tuple(genome_config.input_keys), tuple(genome_config.output_keys),
+            tuple([(key, ng.activation, ng.aggregation) for key, ng in genome.nodes.items()]),
+            tuple([cg.key for cg in genome.connections.values() if cg.enabled]))
+
+
+def _parameters(genome):
+    """The bias and response of every node and the weight of every enabled connection, in genome order."""
+    return (tuple([(ng.bias, ng.response) for ng in genome.nodes.values()]),
+            tuple([cg.weight for cg in genome.connections.values() if cg.enabled]))
+
+
+def compile_genome(genome, config):
+    """Lowers genome to a Program, without caching."""
+    return Program(_Layout(genome, config.genome_config), _parameters(genome))
+
+
+class ProgramCache:
+    def __init__(self, maxsize=4096):
+        """Keeps the maxsize most recently used Programs and layouts.
+
+        Programs are found by the structure and parameters of their genome,
+        layouts by the structure only.
+        """
+        self.maxsize = maxsize
+        self.programs = collections.OrderedDict()
+        self.layouts = collections.OrderedDict()
+        self.hits = 0
+        self.layout_hits = 0
+        self.misses = 0
+
+    def _lookup(self, entries, key):
+        value = entries.get(key)
+        if value is not None:
+            entries.move_to_end(key)
+        return value
+
+    def _store(self, entries, key, value):
+        entries[key] = value
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def get(self, genome, config):
+        """The Program of genome, compiled only when no equal genome was seen recently."""
+        key = structure, parameters = _structure(genome, config.genome_config), _parameters(genome)
+        program = self._lookup(self.programs, key)
+        if program is not None:
+            self.hits += 1
+            return program
+        layout = self._lookup(self.layouts, structure)
+        if layout is not None:
+            self.layout_hits += 1
+        else:
+            self.misses += 1
+            layout = _Layout(genome, config.genome_config)
+            self._store(self.layouts, structure, layout)
+        program = Program(layout, parameters)
+        self._store(self.programs, key, program)
+        return program
+
+
+# shared by the trainers
+PROGRAMS = ProgramCache()
+
+
+def _flat(lists, dtype):
+    """The concatenation of lists, as one array."""
+    return np.fromiter(itertools.chain.from_iterable(lists), dtype=dtype)
+
+
+class _Layer:
+    """Nodes of one topological depth across all genomes, with their incoming links."""
+
+    def __init__(self, nodes, bias, response, codes, src, dst, weights):
+        if (codes < 0).any():
+            raise ValueError("BatchNetwork has no numpy version of some activation function")
+        names = list(ACTIVATIONS)
+        self.nodes = nodes
+        self.bias = bias
+        self.response = response
+        self.groups = [(ACTIVATIONS[names[code]], np.flatnonzero(codes == code)) for code in np.unique(codes)]
+        self.src = src
+        self.dst = dst
+        self.weights = weights
+
+    def tile(self, copies, stride):
+        """This layer repeated copies times, each copy stride values further in the matrix."""
+        tiled = copy.copy(self)
+        shift = stride * np.arange(copies)[:, None]
+        rows = len(self.nodes) * np.arange(copies)[:, None]
+        tiled.nodes = (self.nodes + shift).ravel()
+        tiled.bias = np.tile(self.bias, copies)
+        tiled.response = np.tile(self.response, copies)
+        tiled.groups = [(function, (members + rows).ravel()) for function, members in self.groups]
+        tiled.src = (self.src + shift).ravel()
+        tiled.dst = (self.dst + rows).ravel()
+        tiled.weights = np.tile(self.weights, copies)
+        return tiled
+
+
+class BatchNetwork:
+    def __init__(self, genomes, config, cache=None):
+        """Builds the networks of genomes, a list of (genome_id, genome) pairs.
+
+        The Programs come from cache, a ProgramCache, when one is given, and
+        are compiled otherwise.
+        """
+        genome_config = config.genome_config
+        self.input_keys = list(genome_config.input_keys)
+        self.output_keys = list(genome_config.output_keys)
+        self.num_genomes = len(genomes)
+
+        if cache is None:
+            programs = [compile_genome(genome, config) for genome_id, genome in genomes]
+        else:
+            programs = [cache.get(genome, config) for genome_id, genome in genomes]
+        self.width = max((program.layout.width for program in programs), default=len(self.input_keys))
+        if not programs:
+            self.layers = []
+            return
+
+        # every node and link of the generation, genome after genome
+        layouts = [program.layout for program in programs]
+        sizes = np.array([len(layout.order) for layout in layouts])
+        links = np.array([len(layout.link_index) for layout in layouts])
+        first_node = np.cumsum(sizes) - sizes
+        offset = self.width * np.arange(len(programs))
+        slot = _flat((layout.slot for layout in layouts), int) + np.repeat(offset, sizes)
+        depth = _flat((layout.depth for layout in layouts), int)
+        bias = _flat((program.bias for program in programs), float)
+        response = _flat((program.response for program in programs), float)
+        codes = _flat((layout.codes for layout in layouts), int)
+        src = _flat((layout.link_src for layout in layouts), int) + np.repeat(offset, links)
+        dst = _flat((layout.link_dst for layout in layouts), int) + np.repeat(first_node, links)
+        weights = _flat((program.weights for program in programs), float)
+
+        # position of each node within its depth, in genome order
+        order = np.argsort(depth, kind='stable')
+        position = np.empty(len(depth), dtype=int)
+        counts = np.bincount(depth)
+        ends = np.cumsum(counts)
+        position[order] = np.arange(len(depth)) - np.repeat(ends - counts, counts)
+        link_depth = depth[dst]
+        self.layers = []
+        for d in range(len(counts)):
+            nodes = order[ends[d] - counts[d]:ends[d]]
+            layer_links = link_depth == d
+            self.layers.append(_Layer(slot[nodes], bias[nodes], response[nodes], codes[nodes],
+                                      src[layer_links], position[dst[layer_links]], weights[layer_links]))
+
+    def tile(self, copies):
+        """A BatchNetwork running these networks copies times over in one pass.
+
+        Row c * num_genomes + g of its inputs goes to genome g, for every copy c.
+        """
+        tiled = copy.copy(self)
+        tiled.num_genomes = copies * self.num_genomes
+        tiled.layers = [layer.tile(copies, self.num_genomes * self.width) for layer in self.layers]
+        return tiled
+
+    def activate(self, inputs):
+        """Evaluates every network on its row of the (genomes, inputs) matrix.
+
+        Returns the (genomes, outputs) matrix.
+        """
+        values = np.zeros((self.num_genomes, self.width))
+        values[:, :len(self.input_keys)] = inputs
+        flat = values.ravel()
+        for layer in self.layers:
+            s = np.bincount(layer.dst, weights=flat[layer.src] * layer.weights, minlength=len(layer.nodes))
+            z = layer.bias + layer.response * s
+            for function, members in layer.groups:
+                flat[layer.nodes[members]] = function(z[members])
+        n_in = len(self.input_keys)
+        return values[:, n_in:n_in + len(self.output_keys)]
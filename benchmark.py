@@ -0,0 +1,301 @@
+"""Fixed-seed throughput benchmarks of the simulation hot paths.
+
+Every benchmark sets up the same seeded scenario each time and returns a
+callable running it; only that call is timed, and the report says how many
+ticks it gets through per second. The eval_genomes ones also report
+generations per hour. Results are written as JSON, and can be compared with
+a stored baseline to flag regressions.
+
+    python benchmark.py --out baseline.json
+    python benchmark.py --baseline baseline.json --tolerance 0.1
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import neat
+import numpy as np
+
+import CarsAi2 as ca
+import road_sine
+import sensors
+from batch_net import BatchNetwork, compile_genome
+from car_batch import CarBatch
+
+SEED = 1234
+POPULATIONS = (10, 100, 1000)
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.txt')
+
+
+def load_config(pop_size=None):
+    config = neat.config.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                                neat.DefaultSpeciesSet, neat.DefaultStagnation, CONFIG)
+    if pop_size is not None:
+        config.pop_size = pop_size
+    return config
+
+
+def grid_track():
+    """A seeded track drawn on the trainer's screen, with the trainer's traffic light."""
+    trak = ca.new_track()
+    ca.SCREEN.fill((100, 100, 100))
+    for i in range(len(trak)):
+        trak.draw(i)
+    ca.traf_l_pos = trak.screen_x(5)
+    return trak
+
+
+def bench_car_radar(ticks=500):
+    walls = grid_track().walls()
+    car = ca.Car()
+
+    def run():
+        for _ in range(ticks):
+            car.radars.clear()
+            car.radar(walls)
+        return ticks
+    return run
+
+
+def bench_radar_matrix(cars=1000, ticks=20):
+    walls = grid_track().walls()
+    batch = CarBatch(cars, ca.car_image())
+    rng = np.random.default_rng(SEED)
+    orientations = rng.integers(0, 72, cars) * 5
+    inputs = np.zeros((cars, sensors.NUM_INPUTS))
+
+    def run():
+        for _ in range(ticks):
+            sensors.radar_matrix(batch.center(), orientations, walls, ca.SCREEN_HEIGHT, inputs)
+        return cars * ticks
+    return run
+
+
+def bench_car_detect_collision(ticks=2000):
+    grid_track()
+    car = ca.Car()
+    car.draw_sensors()
+
+    def run():
+        for _ in range(ticks):
+            car.detect_collision()
+        return ticks
+    return run
+
+
+def bench_car_input_move(ticks=10000):
+    car = ca.Car()
+    rng = np.random.default_rng(SEED)
+    commands = rng.integers(0, 2, (ticks, 4)).tolist()
+
+    def run():
+        for command in commands:
+            car.command = command
+            car.input_analisys()
+            car.move()
+            car.rect.center = (100, 350)  # stay on the track
+        return ticks
+    return run
+
+
+def bench_car_batch_update(cars=1000, ticks=200):
+    batch = CarBatch(cars, ca.car_image())
+    rng = np.random.default_rng(SEED)
+    commands = rng.integers(0, 2, (ticks, cars, 4))
+
+    def run():
+        for command in commands:
+            batch.command = command
+            batch.rot_center()
+            batch.update()
+        return cars * ticks
+    return run
+
+
+def bench_env_step(cars=1000, ticks=200):
+    """Scripted random drivers, reset whenever every car has left."""
+    env = ca.CarEnv(cars)
+    rng = np.random.default_rng(SEED)
+    actions = rng.integers(0, 2, (ticks, cars, 4))
+    env.reset(seed=SEED)
+
+    def run():
+        driven = 0
+        for action in actions:
+            if len(env.live) == 0:
+                env.reset(seed=SEED)
+            driven += len(env.live)
+            env.step(action)
+        return driven
+    return run
+
+
+def _genomes(pop_size):
+    config = load_config(pop_size)
+    population = neat.Population(config)
+    return list(population.population.items()), config
+
+
+def bench_network_activate(genomes=100, ticks=20, create=neat.nn.FeedForwardNetwork.create):
+    genomes, config = _genomes(genomes)
+    nets = [create(genome, config) for genome_id, genome in genomes]
+    walls = grid_track().walls()
+    car = ca.Car()
+    car.radar(walls)
+    inputs = car.data()
+
+    def run():
+        for _ in range(ticks):
+            for net in nets:
+                net.activate(inputs)
+        return len(nets) * ticks
+    return run
+
+
+def bench_program_activate(genomes=100, ticks=20):
+    return bench_network_activate(genomes, ticks, compile_genome)
+
+
+def bench_batch_network_activate(genomes=1000, ticks=20):
+    genomes, config = _genomes(genomes)
+    nets = BatchNetwork(genomes, config)
+    inputs = np.random.default_rng(SEED).uniform(0, 250, (len(genomes), sensors.NUM_INPUTS))
+
+    def run():
+        for _ in range(ticks):
+            nets.activate(inputs)
+        return len(genomes) * ticks
+    return run
+
+
+def bench_sine_radar(ticks=100):
+    road = road_sine.Road(road_sine.AMPLITUDE, road_sine.FREQUENCY)
+    car = road_sine.Car(road_sine.CAR_X, road_sine.CAR_RADIUS)
+
+    def run():
+        for _ in range(ticks):
+            road.shift(road_sine.SHIFT_AMOUNT)
+            car.get_radar_data(road)
+        return ticks
+    return run
+
+
+def bench_road_shift(ticks=1000):
+    trak = ca.new_track()
+
+    def run():
+        for _ in range(ticks):
+            trak.shift()
+        return ticks
+    return run
+
+
+def bench_eval_genomes(pop_size):
+    def bench():
+        genomes, config = _genomes(pop_size)
+
+        def run():
+            ca.eval_genomes(genomes, config)
+            return ca.episode_ticks
+        return run
+    return bench
+
+
+BENCHMARKS = {
+    'Car.radar': bench_car_radar,
+    'sensors.radar_matrix': bench_radar_matrix,
+    'Car.detect_collision': bench_car_detect_collision,
+    'Car.input_analisys+move': bench_car_input_move,
+    'CarBatch.update': bench_car_batch_update,
+    'CarEnv.step': bench_env_step,
+    'FeedForwardNetwork.activate': bench_network_activate,
+    'Program.activate': bench_program_activate,
+    'BatchNetwork.activate': bench_batch_network_activate,
+    'road_sine.Car.get_radar_data': bench_sine_radar,
+    'Road.shift': bench_road_shift,
+}
+for n in POPULATIONS:
+    BENCHMARKS['eval_genomes[{0}]'.format(n)] = bench_eval_genomes(n)
+
+
+def measure(bench, repeat):
+    """Sets bench up and runs it repeat times from the same seed, keeping the fastest run.
+
+    Only the run is timed, not the setup.
+    """
+    best = None
+    for _ in range(repeat):
+        random.seed(SEED)
+        with contextlib.redirect_stdout(io.StringIO()):
+            run = bench()
+            start = time.perf_counter()
+            ticks = run()
+            seconds = time.perf_counter() - start
+        if best is None or seconds < best[1]:
+            best = (ticks, seconds)
+    ticks, seconds = best
+    return {'ticks': ticks, 'seconds': seconds, 'ticks_per_second': ticks / seconds}
+
+
+def run(names, repeat):
+    ca.HEADLESS = True
+    ca.pop = neat.Population(load_config())  # for the generation new_track reads
+    results = {}
+    for name in names:
+        result = measure(BENCHMARKS[name], repeat)
+        if name.startswith('eval_genomes'):
+            result['generations_per_hour'] = 3600 / result['seconds']
+        results[name] = result
+        print("{0:30} {1:14.1f} ticks/s".format(name, result['ticks_per_second']), file=sys.stderr)
+    return {'seed': SEED, 'repeat': repeat, 'python': platform.python_version(),
+            'numpy': np.__version__, 'benchmarks': results}
+
+
+def compare(report, baseline, tolerance):
+    """Returns the names of the benchmarks more than tolerance slower than in baseline."""
+    regressions = []
+    for name, result in report['benchmarks'].items():
+        old = baseline['benchmarks'].get(name)
+        if old is None:
+            continue
+        ratio = result['ticks_per_second'] / old['ticks_per_second']
+        result['baseline_ratio'] = ratio
+        result['regression'] = ratio < 1 - tolerance
+        if result['regression']:
+            regressions.append(name)
+        print("{0:30} {1:6.2f}x{2}".format(name, ratio, "  REGRESSION" if result['regression'] else ""),
+              file=sys.stderr)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the simulation hot paths on fixed seeds.")
+    parser.add_argument("--out", default=None, help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", default=None, help="JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="slowdown, as a fraction, flagged as a regression")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    args = parser.parse_args()
+
+    report = run(args.only, args.repeat)
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+    text = json.dumps(report, indent=2)
+    if args.out is None:
+        print(text)
+    else:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,167 @@
+"""Structure-of-arrays kinematics for a whole population of grid-track cars.
+
+CarBatch holds the per-car state of CarsAi2.Car as NumPy arrays and applies
+Car.rot_center, draw_sensors, input_analisys and move to every car in one
+step. CarView sprites read a single slot back for rendering.
+"""
+import enum
+
+import numpy as np
+import pygame
+
+import rotation_cache
+
+MAX_VELOCITY = 10
+MAX_PEDAL_TIME = 90
+MAX_SPEED = 30  # velocity cap of Car.move
+TURN_STEP = 5
+MIN_TURN_SPEED = 1.5
+MAX_TURN_SPEED = 20
+
+START_X = 100
+START_Y = 350
+
+# Car.body_orientation only takes multiples of TURN_STEP in [0, 360)
+_COS = np.cos(np.radians(np.arange(360)))
+_SIN = np.sin(np.radians(np.arange(360)))
+
+
+class Crash(enum.IntEnum):
+    """Why a car left the episode, see CarsAi2.detect_collisions and termination."""
+    NONE = 0
+    BOUNDARIES = 1  # a front corner left the screen margins
+    COLLISION = 2  # a front corner is on a wall
+    RED_LIGHT = 3  # drove up to a red traffic light
+    TOO_SLOW = 4  # stood still too long near the start
+    STALLED = 5  # stood still too long further on
+    TICK_BUDGET = 6  # the episode ran out of ticks, see termination
+    NO_PROGRESS = 7  # moved too little along the track for too long
+    DECIDED = 8  # could no longer beat the best fitness of the episode
+
+
+def round_rect(values):
+    """Rounds like pygame.Rect does when a float is assigned: half away from zero."""
+    whole = np.trunc(values)
+    return (whole + np.sign(values) * (np.abs(values - whole) >= 0.5)).astype(int)
+
+
+class CarBatch:
+    def __init__(self, n, image):
+        self.image_ori = image
+        self.w_ori = image.get_width()
+        self.h_ori = image.get_height()
+        self.sizes, self.left_offsets, self.right_offsets = rotation_cache.tables(image)
+
+        # pygame.Rect of each car, as image.get_rect(center=(START_X, START_Y))
+        self.w = np.full(n, self.w_ori)
+        self.h = np.full(n, self.h_ori)
+        self.x = np.full(n, START_X - self.w_ori // 2)
+        self.y = np.full(n, START_Y - self.h_ori // 2)
+
+        self.x_velocity = np.zeros(n)
+        self.y_velocity = np.zeros(n)
+        self.pedal_time = np.zeros(n, dtype=int)
+        self.body_orientation = np.zeros(n, dtype=int)
+
+        self.command = np.zeros((n, 4), dtype=int)
+        self.left_sensor = np.zeros((n, 2))
+        self.right_sensor = np.zeros((n, 2))
+        self.previous_pos = np.zeros((n, 2))
+        self.still = np.zeros(n, dtype=int)
+
+        self.alive = np.ones(n, dtype=bool)
+        self.crashed = np.zeros(n, dtype=bool)
+        self.crash_cause = np.zeros(n, dtype=np.int8)
+        self.finish_portion = np.zeros(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.x)
+
+    def views(self):
+        return [CarView(self, i) for i in range(len(self))]
+
+    def center(self):
+        return np.column_stack((self.x + self.w // 2, self.y + self.h // 2))
+
+    def centerx(self):
+        return self.x + self.w // 2
+
+    def rotation_index(self):
+        return (self.body_orientation // rotation_cache.ROTATION_STEP) % rotation_cache.ROTATIONS
+
+    def rot_center(self):
+        """Re-centres every rect on the size of its rotated image."""
+        cx, cy = self.x + self.w // 2, self.y + self.h // 2
+        self.w, self.h = self.sizes[self.rotation_index()].T
+        self.x = cx - self.w // 2
+        self.y = cy - self.h // 2
+
+    def draw_sensors(self):
+        index = self.rotation_index()
+        corner = np.column_stack((self.x, self.y))
+        self.left_sensor = corner + self.left_offsets[index]
+        self.right_sensor = corner + self.right_offsets[index]
+
+    def input_analisys(self):
+        self.previous_pos[:] = self.left_sensor
+        w, a, d, s = self.command.T.astype(bool)
+
+        self.pedal_time += np.where(w, 2, np.where(s, -4, -1))
+        np.clip(self.pedal_time, 0, MAX_PEDAL_TIME, out=self.pedal_time)
+
+        velocity = np.minimum(MAX_VELOCITY*self.pedal_time/40, MAX_VELOCITY)
+        self.x_velocity = velocity*_COS[self.body_orientation]
+        self.y_velocity = velocity*_SIN[self.body_orientation]
+
+        speed = (self.x_velocity**2 + self.y_velocity**2)**0.5
+        can_turn = (speed > MIN_TURN_SPEED) & (speed <= MAX_TURN_SPEED)
+        self.body_orientation += TURN_STEP*(a & can_turn) - TURN_STEP*(d & can_turn)
+
+        self.body_orientation[self.body_orientation > 359] = 0
+        self.body_orientation[self.body_orientation < 0] += 360
+
+    def move(self):
+        driving = ~self.finish_portion
+        capped = self.x_velocity > MAX_SPEED
+        self.y_velocity = np.where(capped & (self.y_velocity > MAX_SPEED), MAX_SPEED, self.y_velocity)
+        self.x_velocity = np.where(capped, MAX_SPEED, self.x_velocity)
+
+        self.x = np.where(driving, round_rect(self.x + self.x_velocity), self.x)
+        self.y = np.where(driving, round_rect(self.y - self.y_velocity), self.y)
+
+        self.x_velocity[self.finish_portion] = 0
+        self.y_velocity[self.finish_portion] = 0
+
+    def update(self):
+        """Car.update without the radar, see sensors.radar_matrix."""
+        self.draw_sensors()
+        self.input_analisys()
+        self.move()
+
+    def shift(self, dx, cars=slice(None)):
+        self.x[cars] -= dx
+
+
+class CarView(pygame.sprite.Sprite):
+    """Sprite drawing one slot of a CarBatch."""
+
+    def __init__(self, batch, index):
+        super().__init__()
+        self.batch = batch
+        self.index = index
+
+    @property
+    def body_orientation(self):
+        return int(self.batch.body_orientation[self.index])
+
+    @property
+    def image(self):
+        return rotation_cache.rotate(self.batch.image_ori, self.body_orientation).image
+
+    @property
+    def rect(self):
+        b, i = self.batch, self.index
+        return pygame.Rect(int(b.x[i]), int(b.y[i]), int(b.w[i]), int(b.h[i]))
+
+    def draw(self, SCREEN):
+        SCREEN.blit(self.image, self.rect)
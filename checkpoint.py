@@ -0,0 +1,93 @@
+"""Periodic, resumable snapshots of a neat.Population.
+
+Checkpointer is a neat reporter. At the end of a generation it pickles what
+Population.run needs to carry on exactly where it was: the genomes, the
+species, the genome and node counters, the best genome and the state of the
+random module. Pickling happens in memory; a background thread compresses
+the snapshot and writes it to a temporary file that is then renamed over the
+checkpoint, so a run killed mid-write never leaves a truncated file behind.
+"""
+import gzip
+import os
+import pickle
+import random
+import threading
+import time
+
+import neat
+
+
+class Checkpointer(neat.reporting.BaseReporter):
+    def __init__(self, population, generation_interval=None, time_interval=None, prefix='neat-checkpoint-'):
+        """Saves population every generation_interval generations and/or every time_interval seconds."""
+        self.population = population
+        self.generation_interval = generation_interval
+        self.time_interval = time_interval
+        self.prefix = prefix
+
+        self.current_generation = None
+        self.last_generation_checkpoint = population.generation - 1
+        self.last_time_checkpoint = time.time()
+        self._writer = None
+
+    def start_generation(self, generation):
+        self.current_generation = generation
+
+    def end_generation(self, config, population, species_set):
+        due = False
+        if self.generation_interval is not None:
+            due = self.current_generation - self.last_generation_checkpoint >= self.generation_interval
+        if self.time_interval is not None:
+            due = due or time.time() - self.last_time_checkpoint >= self.time_interval
+        if due:
+            self.save(self.current_generation + 1)
+            self.last_generation_checkpoint = self.current_generation
+            self.last_time_checkpoint = time.time()
+
+    def found_solution(self, config, generation, best):
+        self.wait()
+
+    def save(self, generation):
+        """Snapshots the population, which is about to run generation, and writes it in the background."""
+        pop = self.population
+        # the species set shares the population's reporters, this one included
+        reporters, pop.species.reporters = pop.species.reporters, None
+        try:
+            state = pickle.dumps((generation, pop.config, pop.population, pop.species,
+                                  pop.reproduction.genome_indexer, pop.reproduction.ancestors,
+                                  pop.best_genome, random.getstate()), protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            pop.species.reporters = reporters
+
+        self.wait()
+        filename = '{0}{1}'.format(self.prefix, generation)
+        print("Saving checkpoint to {0}".format(filename))
+        self._writer = threading.Thread(target=write_atomic, args=(filename, state))
+        self._writer.start()
+
+    def wait(self):
+        """Blocks until the last checkpoint is on disk."""
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+
+def write_atomic(filename, state):
+    tmp = filename + '.tmp'
+    with gzip.open(tmp, 'wb', compresslevel=5) as f:
+        f.write(state)
+    os.replace(tmp, filename)
+
+
+def restore(filename):
+    """Returns the neat.Population saved in filename, and puts the random module back in its saved state."""
+    with gzip.open(filename) as f:
+        (generation, config, population, species, genome_indexer, ancestors,
+         best_genome, rng_state) = pickle.load(f)
+    pop = neat.Population(config, (population, species, generation))
+    species.reporters = pop.reporters
+    pop.reproduction.genome_indexer = genome_indexer
+    pop.reproduction.ancestors = ancestors
+    pop.best_genome = best_genome
+    random.setstate(rng_state)
+    return pop
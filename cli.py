@@ -0,0 +1,58 @@
+"""Single command line entry point of the simulators.
+
+    python cli.py grid [options]       train on the grid track, see CarsAi2.py
+    python cli.py sine [--config ...]  train on the sine road, see road_sine.py
+    python cli.py demo [--check]       scrolling road demo, see animation_loop.py
+
+A subcommand only imports the module it runs, and nothing opens a window
+or loads an asset before that module's front end starts.
+"""
+import argparse
+import os
+import sys
+
+LOCAL_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def grid(argv):
+    import CarsAi2
+    parser = argparse.ArgumentParser(prog="cli.py grid", description="Train the NEAT cars on the grid track.")
+    CarsAi2.add_arguments(parser)
+    CarsAi2.main(parser.parse_args(argv), parser)
+
+
+def sine(argv):
+    parser = argparse.ArgumentParser(prog="cli.py sine", description="Train the NEAT car on the sine road.")
+    parser.add_argument("--config", default=os.path.join(LOCAL_DIR, "config-feedforward.txt"))
+    args = parser.parse_args(argv)
+    import road_sine
+    road_sine.run_neat(args.config)
+
+
+def demo(argv):
+    parser = argparse.ArgumentParser(prog="cli.py demo", description="Scroll the sine road under a radar car.")
+    parser.add_argument("--check", action="store_true",
+                        help="compare the radar's intersection routines instead of opening the demo")
+    args = parser.parse_args(argv)
+    import animation_loop
+    if args.check:
+        mismatches = animation_loop.check_intersections()
+        for name, count in mismatches.items():
+            print(f"{name}: {count} rays disagree with the bucket index")
+        sys.exit(1 if mismatches["find_intersection"] else 0)
+    animation_loop.main()
+
+
+COMMANDS = {'grid': grid, 'sine': sine, 'demo': demo}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NEAT autonomous cars.")
+    parser.add_argument("command", choices=list(COMMANDS))
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="options of the command, see COMMAND --help")
+    args = parser.parse_args(argv)
+    COMMANDS[args.command](args.args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""The best genomes seen over a whole run, kept on disk.
+
+HallOfFame is a neat reporter that keeps the top-K genomes by fitness across
+generations. The file is only rewritten when that set changes, and by a
+background thread, so evaluation never waits on the disk.
+
+File layout, little endian: the magic b'HOF1' and the entry count, then one
+ENTRY record per genome, best first, then the zlib compressed pickles of the
+(genome_id, genome) pairs the records point at. load() reads the records and
+unpickles only the genome asked for.
+"""
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+import neat
+
+MAGIC = b'HOF1'
+HEADER = struct.Struct('<4sI')
+ENTRY = struct.Struct('<qdIQI')  # genome id, fitness, generation, blob offset, blob length
+
+
+class HallOfFame(neat.reporting.BaseReporter):
+    def __init__(self, filename, size=10, resume=False):
+        """Keeps the size best genomes in filename.
+
+        A resumed run starts from what filename already holds; any other run
+        starts empty and overwrites it, since genome ids restart with each run.
+        """
+        if size < 1:
+            raise ValueError("a hall of fame keeps at least 1 genome, not {0}".format(size))
+        self.filename = filename
+        self.size = size
+        self.generation = None
+        self._writer = None
+        # genome id -> (fitness, generation, compressed pickle)
+        self.entries = {}
+        if resume and os.path.exists(filename):
+            for genome_id, fitness, generation, blob in _read(filename):
+                self.entries[genome_id] = (fitness, generation, blob)
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def post_evaluate(self, config, population, species, best_genome):
+        floor = self.ranking()[-1][1][0] if len(self.entries) >= self.size else None
+        changed = False
+        for genome_id, genome in population.items():
+            if genome.fitness is None or (floor is not None and genome.fitness <= floor):
+                continue
+            entry = self.entries.get(genome_id)
+            if entry is not None and genome.fitness <= entry[0]:
+                continue
+            blob = zlib.compress(pickle.dumps((genome_id, genome), protocol=pickle.HIGHEST_PROTOCOL))
+            self.entries[genome_id] = (genome.fitness, self.generation, blob)
+            changed = True
+        if changed:
+            self.entries = dict(self.ranking()[:self.size])
+            self.save()
+
+    def found_solution(self, config, generation, best):
+        self.wait()
+
+    def ranking(self):
+        """Returns the (genome_id, (fitness, generation, blob)) pairs, best first."""
+        return sorted(self.entries.items(), key=lambda item: item[1][0], reverse=True)
+
+    def save(self):
+        """Writes the current entries in the background."""
+        self.wait()
+        data = _pack(self.ranking())
+        self._writer = threading.Thread(target=_write_atomic, args=(self.filename, data))
+        self._writer.start()
+
+    def wait(self):
+        """Blocks until the last write is on disk."""
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+
+
+def _pack(ranking):
+    offset = HEADER.size + ENTRY.size * len(ranking)
+    records, blobs = [], []
+    for genome_id, (fitness, generation, blob) in ranking:
+        records.append(ENTRY.pack(genome_id, fitness, generation, offset, len(blob)))
+        blobs.append(blob)
+        offset += len(blob)
+    return HEADER.pack(MAGIC, len(ranking)) + b''.join(records) + b''.join(blobs)
+
+
+def _write_atomic(filename, data):
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, filename)
+
+
+def _read_index(f):
+    magic, count = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("{0!r} is not a hall of fame file".format(f.name))
+    return [ENTRY.unpack(f.read(ENTRY.size)) for _ in range(count)]
+
+
+def _read(filename):
+    with open(filename, 'rb') as f:
+        index = _read_index(f)
+        entries = []
+        for genome_id, fitness, generation, offset, length in index:
+            f.seek(offset)
+            entries.append((genome_id, fitness, generation, f.read(length)))
+    return entries
+
+
+def index(filename):
+    """Returns the (genome_id, fitness, generation) of every genome in filename, best first."""
+    with open(filename, 'rb') as f:
+        return [record[:3] for record in _read_index(f)]
+
+
+def load(filename, rank=0):
+    """Returns the (genome_id, genome) pair at rank in filename, 0 being the best."""
+    with open(filename, 'rb') as f:
+        genome_id, fitness, generation, offset, length = _read_index(f)[rank]
+        f.seek(offset)
+        return pickle.loads(zlib.decompress(f.read(length)))
@@ -0,0 +1,205 @@
+"""Recording and playback of grid-track training episodes.
+
+Recorder logs what every live car does on every tick of an eval_genomes
+episode: its centre, body_orientation, command, radar distances and crash
+cause, as one fixed-size RECORD per car and tick. The records go to
+gen-NNNNN.cars in the recording directory, written by a background thread.
+The track points, each time they change, and the genome id of every car slot
+go to gen-NNNNN.track.npz at the end of the episode.
+
+Playback memory-maps the .cars file and only reads the ticks it shows, so
+any generation, car or tick range can be watched without simulating again
+and without neat:
+
+    python replay.py replays --generation 7 --cars 0 3 --start 200
+
+Space pauses, the right and left arrows skip forward and back, up and down
+change the playback speed.
+"""
+import argparse
+import os
+import queue
+import threading
+
+import numpy as np
+import pygame
+
+import Road as road
+import sensors
+
+RECORD = np.dtype([
+    ('tick', '<u4'),
+    ('car', '<u2'),  # slot of the car in the generation, see genome_ids
+    ('x', '<i2'),  # centre of the car's rect
+    ('y', '<i2'),
+    ('orientation', '<u2'),
+    ('command', 'u1'),  # w, a, d, s as bits 0 to 3
+    ('radar', '<u2', (len(sensors.RADAR_ANGLES),)),
+    ('crash', 'i1'),  # car_batch.Crash
+])
+
+COMMAND_BITS = np.array([1, 2, 4, 8])
+
+
+def episode_path(directory, generation):
+    return os.path.join(directory, 'gen-{0:05d}'.format(generation))
+
+
+class Recorder:
+    """Logs one episode of a CarBatch in the background."""
+
+    def __init__(self, directory, generation, genome_ids):
+        os.makedirs(directory, exist_ok=True)
+        self.path = episode_path(directory, generation)
+        self.genome_ids = np.array(genome_ids)
+        self.track_ticks = []
+        self.track_points = []
+        self._last_track = None
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write, args=(self.path + '.cars',))
+        self._writer.start()
+
+    def _write(self, filename):
+        with open(filename, 'wb') as f:
+            while True:
+                records = self._queue.get()
+                if records is None:
+                    return
+                records.tofile(f)
+
+    def record(self, tick, batch, live, radar):
+        """Queues the records of the live cars of batch, with their (live, beams) radar distances."""
+        records = np.empty(len(live), dtype=RECORD)
+        center = batch.center()[live]
+        records['tick'] = tick
+        records['car'] = live
+        records['x'] = center[:, 0]
+        records['y'] = center[:, 1]
+        records['orientation'] = batch.body_orientation[live]
+        records['command'] = batch.command[live] @ COMMAND_BITS
+        records['radar'] = radar
+        records['crash'] = batch.crash_cause[live]
+        self._queue.put(records)
+
+    def record_track(self, tick, trak):
+        """Keeps the screen points of trak when they differ from the last ones kept."""
+        points = np.column_stack((trak.x - trak.offset, trak.y, trak.light))
+        if self._last_track is None or not np.array_equal(points, self._last_track):
+            self.track_ticks.append(tick)
+            self.track_points.append(points)
+            self._last_track = points
+
+    def close(self):
+        """Writes the track file and waits for the writer thread to finish the .cars file."""
+        self._queue.put(None)
+        self._writer.join()
+        np.savez(self.path + '.track.npz', ticks=np.array(self.track_ticks, dtype=np.uint32),
+                 points=np.stack(self.track_points), genome_ids=self.genome_ids)
+
+
+class Replay:
+    """A recorded episode, memory-mapped."""
+
+    def __init__(self, directory, generation):
+        path = episode_path(directory, generation)
+        self.records = np.memmap(path + '.cars', dtype=RECORD, mode='r')
+        track = np.load(path + '.track.npz')
+        self.track_ticks = track['ticks']
+        self.track_points = track['points']
+        self.genome_ids = track['genome_ids']
+        self.first_tick = int(self.records['tick'][0]) if len(self.records) else 0
+        self.last_tick = int(self.records['tick'][-1]) if len(self.records) else 0
+
+    def tick(self, tick, cars=None):
+        """Returns the records of tick, only those of the car slots in cars when given."""
+        ticks = self.records['tick']
+        records = self.records[np.searchsorted(ticks, tick):np.searchsorted(ticks, tick, side='right')]
+        if cars is not None:
+            records = records[np.isin(records['car'], cars)]
+        return records
+
+    def track(self, tick):
+        """Returns the (points, 3) screen x, y and light of the track at tick."""
+        i = max(np.searchsorted(self.track_ticks, tick, side='right') - 1, 0)
+        return self.track_points[i]
+
+
+def draw_track(screen, points):
+    """Road.draw for recorded points."""
+    for i, (x1, y1, light) in enumerate(points):
+        if i > 0:
+            x0, y0 = points[i-1][:2]
+            for side in (road.TRACK_WIDTH, -road.TRACK_WIDTH):
+                pygame.draw.line(screen, (2, 105, 31, 255), (x0, y0+side), (x1, y1+side), road.WALL_WIDTH)
+        if light == 1:
+            pygame.draw.line(screen, (255, 0, 0, 255), (x1, y1 + road.TRAF_WIDTH), (x1, y1 - road.TRAF_WIDTH), 5)
+        if light == 2:
+            pygame.draw.line(screen, (0, 255, 0, 255), (x1, y1 + road.TRAF_WIDTH), (x1, y1 - road.TRAF_WIDTH), 5)
+
+
+def draw_cars(screen, image, records, font):
+    for record in records:
+        center = (int(record['x']), int(record['y']))
+        orientation = int(record['orientation'])
+        rotated = pygame.transform.rotate(image, orientation)
+        screen.blit(rotated, rotated.get_rect(center=center))
+        angles = np.radians(orientation + sensors.RADAR_ANGLES)
+        for angle, dist in zip(angles, record['radar']):
+            end = (center[0] + dist * np.cos(angle), center[1] - dist * np.sin(angle))
+            pygame.draw.line(screen, (255, 255, 255, 255), center, end, 1)
+        label = font.render(str(int(record['car'])), True, (0, 0, 0))
+        screen.blit(label, (center[0] + 15, center[1] - 25))
+
+
+def play(replay, cars=None, start=None, end=None, fps=50):
+    pygame.init()
+    screen = pygame.display.set_mode((1400, 700))
+    image = pygame.image.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), "CarAssets", "carf.png"))
+    font = pygame.font.Font('freesansbold.ttf', 20)
+    clock = pygame.time.Clock()
+
+    first = replay.first_tick if start is None else start
+    last = replay.last_tick if end is None else end
+    tick, speed, paused = first, 1, False
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                return
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_SPACE:
+                    paused = not paused
+                elif event.key == pygame.K_RIGHT:
+                    tick += 10 * speed
+                elif event.key == pygame.K_LEFT:
+                    tick -= 10 * speed
+                elif event.key == pygame.K_UP:
+                    speed *= 2
+                elif event.key == pygame.K_DOWN:
+                    speed = max(speed // 2, 1)
+        tick = min(max(tick, first), last)
+
+        screen.fill((100, 100, 100))
+        draw_track(screen, replay.track(tick))
+        records = replay.tick(tick, cars)
+        draw_cars(screen, image, records, font)
+        status = 'Tick {0}/{1}  x{2}  cars {3}{4}'.format(tick, last, speed, len(records),
+                                                        '  paused' if paused else '')
+        screen.blit(font.render(status, True, (0, 0, 0)), (50, 660))
+        pygame.display.update()
+        clock.tick(fps)
+
+        if not paused and tick < last:
+            tick += speed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play back an episode recorded with CarsAi2.py --record.")
+    parser.add_argument("directory")
+    parser.add_argument("--generation", type=int, default=0)
+    parser.add_argument("--cars", type=int, nargs="+", default=None, help="car slots to show, all by default")
+    parser.add_argument("--start", type=int, default=None, help="first tick")
+    parser.add_argument("--end", type=int, default=None, help="last tick")
+    parser.add_argument("--fps", type=int, default=50)
+    args = parser.parse_args()
+    play(Replay(args.directory, args.generation), args.cars, args.start, args.end, args.fps)
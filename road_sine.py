@@ -2,14 +2,13 @@ import pygame
 import neat
 import os
 import math
+import numpy as np
 
-# Initialize Pygame
-pygame.init()
+from batch_net import PROGRAMS
 
 # Screen dimensions
 WIDTH, HEIGHT = 900, 600
-SCREEN = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Scrolling Sine Road with Car")
+SCREEN = None  # opened by init_display()
 
 # Colors
 WHITE = (255, 255, 255)
@@ -27,12 +26,22 @@ BLACK = (0, 0, 0)         # Crayola Black
 AMPLITUDE = 100
 FREQUENCY = 0.02
 SHIFT_AMOUNT = 5
+POINT_SPACING = 5  # x distance between two road points
 
 # Car parameters
 CAR_RADIUS = 10
+RADAR_RANGE = 200  # beam length of Car.get_radar_data
 CAR_X = WIDTH // 2 #Chase car is 1/2 of the screen away
 TARGET_CAR_OFFSET = WIDTH // 4 #Target car is 1/4 of the screen away
 
+def init_display():
+    """Initializes pygame and opens the window the trainer draws on."""
+    global SCREEN
+    pygame.init()
+    SCREEN = pygame.display.set_mode((WIDTH, HEIGHT))
+    pygame.display.set_caption("Scrolling Sine Road with Car")
+
+
 class Road:
     def __init__(self, amplitude, frequency, road_width=WIDTH):
         self.amplitude = amplitude
@@ -51,7 +60,9 @@ class Road:
         self.center_points = []
         self.top_points = []
         self.bottom_points = []
-        for x in range(0, self.road_width * 2, 5):
+        self._center_y = None  # array copy of the centre y for get_y_at_x
+        self._edges = None  # top and bottom y arrays for edge_segments
+        for x in range(0, self.road_width * 2, POINT_SPACING):
             center_y = HEIGHT // 2 + self.amplitude * math.sin(self.frequency * x)
             self.center_points.append((x, center_y))
             self.top_points.append((x, center_y - self.road_width // 2))
@@ -65,17 +76,19 @@ class Road:
 
     def draw_line(self, surface, points, width, color):
         """Draws the road line given."""
-        for i in range(len(self.points) - 1):
-            x1 = self.points[i][0] - self.x_offset  # Apply the offset here
-            y1 = self.points[i][1]
-            x2 = self.points[i+1][0] - self.x_offset  # Apply the offset here
-            y2 = self.points[i+1][1]
+        for i in range(len(points) - 1):
+            x1 = points[i][0] - self.x_offset  # Apply the offset here
+            y1 = points[i][1]
+            x2 = points[i+1][0] - self.x_offset  # Apply the offset here
+            y2 = points[i+1][1]
             if 0 <= x1 <= self.road_width or 0 <= x2 <= self.road_width: #Only draw lines that are on screen
-                pygame.draw.line(surface, WHITE, (x1, y1), (x2, y2), 3)
+                pygame.draw.line(surface, color, (x1, y1), (x2, y2), width)
 
     def shift(self, shift_amount):
         """Shift all road lines and dynamically add/remove points."""
         self.x_offset += shift_amount
+        self._center_y = None
+        self._edges = None
 
         self.shift_line(self.center_points)
         self.shift_line(self.top_points)
@@ -90,7 +103,7 @@ class Road:
         # Add new points to the right to maintain continuity
         while points[-1][0] - self.x_offset < WIDTH + 10:
             last_x = points[-1][0]
-            new_x = last_x + 5
+            new_x = last_x + POINT_SPACING
             if points is self.center_points:
                 new_y = HEIGHT // 2 + self.amplitude * math.sin(self.frequency * new_x)
             elif points is self.top_points:
@@ -104,16 +117,80 @@ class Road:
 
 
     def get_y_at_x(self, x):
-        """Returns the y-value of the sine wave at the given x."""
-        for i in range(len(self.center_points) -1):
-            if self.center_points[i][0] <= x <= self.center_points[i+1][0]:
-                x1 = self.center_points[i][0]
-                y1 = self.center_points[i][1]
-                x2 = self.center_points[i+1][0]
-                y2 = self.center_points[i+1][1]
-                slope = (y2-y1)/(x2-x1)
-                return y1 + slope*(x - x1)
-        return None
+        """Returns the y-value of the sine wave at the given x.
+
+        The centre points are POINT_SPACING apart, so the segment holding x is
+        found by index instead of a scan. x can also be a NumPy array, then an
+        array comes back with NaN where the plain call would return None.
+        """
+        if np.ndim(x):
+            return self._get_y_at_xs(np.asarray(x, dtype=float))
+        first_x = self.center_points[0][0]
+        if not first_x <= x <= self.center_points[-1][0]:
+            return None
+        i = max(math.ceil((x - first_x) / POINT_SPACING) - 1, 0)
+        x1, y1 = self.center_points[i]
+        x2, y2 = self.center_points[i+1]
+        slope = (y2-y1)/(x2-x1)
+        return y1 + slope*(x - x1)
+
+    def _get_y_at_xs(self, xs):
+        if self._center_y is None:
+            self._center_y = np.array([p[1] for p in self.center_points])
+        first_x = self.center_points[0][0]
+        on_road = (xs >= first_x) & (xs <= self.center_points[-1][0])
+        xs = np.where(on_road, xs, first_x)
+        i = np.maximum(np.ceil((xs - first_x) / POINT_SPACING).astype(int) - 1, 0)
+        y1 = self._center_y[i]
+        y2 = self._center_y[i+1]
+        slope = (y2-y1)/POINT_SPACING
+        return np.where(on_road, y1 + slope*(xs - (first_x + i*POINT_SPACING)), np.nan)
+
+    def edge_segments(self, lo, hi):
+        """Returns the top and bottom edge segments between screen x lo and hi.
+
+        The result is an (M, 4) array of x1, y1, x2, y2 in screen coordinates,
+        sliced by index since the edge points are POINT_SPACING apart.
+        """
+        if self._edges is None:
+            self._edges = (np.array([p[1] for p in self.top_points]),
+                           np.array([p[1] for p in self.bottom_points]))
+        first_x = self.top_points[0][0]
+        start = max(math.floor((lo + self.x_offset - first_x) / POINT_SPACING), 0)
+        stop = max(math.ceil((hi + self.x_offset - first_x) / POINT_SPACING) + 1, start)
+        segments = []
+        for ys in self._edges:
+            ys = ys[start:stop]
+            xs = first_x - self.x_offset + POINT_SPACING * np.arange(start, start + len(ys))
+            segments.append(np.column_stack((xs[:-1], ys[:-1], xs[1:], ys[1:])))
+        return np.concatenate(segments)
+
+
+def cast_beams(xs, ys, road, num_beams=12):
+    """Distance from each car along each of its radar beams to the nearest road edge.
+
+    Every beam is intersected once, at its full RADAR_RANGE length, with all the
+    edge segments in reach. Returns a (cars, num_beams) array holding NaN where
+    a beam reaches no edge.
+    """
+    xs = np.asarray(xs, dtype=float)[:, None, None]
+    ys = np.asarray(ys, dtype=float)[:, None, None]
+    angles = np.arange(num_beams) / num_beams * 2 * math.pi
+    dx = (RADAR_RANGE * np.cos(angles))[:, None]
+    dy = (RADAR_RANGE * np.sin(angles))[:, None]
+    if len(xs) == 0:
+        return np.empty((0, num_beams))
+
+    x3, y3, x4, y4 = road.edge_segments(xs.min() - RADAR_RANGE, xs.max() + RADAR_RANGE).T
+    # same parametrisation as Car.find_intersection, ua is the fraction along the beam
+    denom = (y4 - y3) * dx - (x4 - x3) * dy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ua = ((x4 - x3) * (ys - y3) - (y4 - y3) * (xs - x3)) / denom
+        ub = (dx * (ys - y3) - dy * (xs - x3)) / denom
+    hit = (denom != 0) & (ua >= 0) & (ua <= 1) & (ub >= 0) & (ub <= 1)
+    nearest = np.where(hit, ua, np.inf).min(axis=2, initial=np.inf)
+    return np.where(np.isfinite(nearest), nearest * RADAR_RANGE, np.nan)
+
 
 class Car: #Red car
     def __init__(self, x, radius):
@@ -157,38 +234,20 @@ class Car: #Red car
             pygame.draw.circle(screen, RED, (self.x, self.y), self.radius)
 
     def get_radar_data(self, road, num_beams=12):
-        """Calculates distance and angle to the road edges."""
-        self.radar_data = []
-        for i in range(num_beams):
-            angle = (i / num_beams) * 2 * math.pi
-
-            ray_length = 0
-            ray_x = self.x
-            ray_y = self.y
-            while ray_length < 200:
-                ray_x += math.cos(angle)
-                ray_y += math.sin(angle)
-                ray_length += 1
-
-                # Check intersection with top and bottom points
-                intersect_top = self.find_intersection(self.x, self.y, ray_x, ray_y, road.top_points, road.x_offset)
-                intersect_bottom = self.find_intersection(self.x, self.y, ray_x, ray_y, road.bottom_points,
-                                                          road.x_offset)
-
-                if intersect_top is not None:
-                    dist = math.sqrt((intersect_top[0] - self.x) ** 2 + (intersect_top[1] - self.y) ** 2)
-                    self.radar_data.append((dist, angle))
-                    ray_length = 200  # End the ray cast
-                    break  # Stop checking points for this ray
-
-                if intersect_bottom is not None:
-                    dist = math.sqrt((intersect_bottom[0] - self.x) ** 2 + (intersect_bottom[1] - self.y) ** 2)
-                    self.radar_data.append((dist, angle))
-                    ray_length = 200  # End the ray cast
-                    break  # Stop checking points for this ray
+        """Calculates distance and angle to the road edges.
 
+        Beams that reach no edge within RADAR_RANGE read RADAR_RANGE, as in
+        animation_loop, so the network always gets 2 * num_beams inputs.
+        """
+        self.set_radar_data(cast_beams([self.x], [self.y], road, num_beams)[0])
         return self.radar_data
 
+    def set_radar_data(self, distances):
+        """Stores one row of cast_beams as the (distance, angle) radar list."""
+        num_beams = len(distances)
+        self.radar_data = [(RADAR_RANGE if math.isnan(dist) else dist, (i / num_beams) * 2 * math.pi)
+                           for i, dist in enumerate(distances.tolist())]
+
     def find_intersection(self, x1, y1, x2, y2, points, x_offset):
         for i in range(len(points) - 1):
             x3 = points[i][0] - x_offset
@@ -241,7 +300,7 @@ def eval_genomes(genomes, config):
     # Initialize cars, genomes, and networks
     for genome_id, genome in genomes:
         genome.fitness = 0
-        net = neat.nn.FeedForwardNetwork.create(genome, config)
+        net = PROGRAMS.get(genome, config)
         nets.append(net)
         car = Car(CAR_X, CAR_RADIUS)
         car.get_radar_data(road)
@@ -258,11 +317,11 @@ def eval_genomes(genomes, config):
 
         target_car.update(road, road.x_offset)  # Update the target car position
 
-        for i, car in enumerate(cars):
-            if not car.alive:
-                continue
-            else:
-                car.get_radar_data(road) #Gets boundary vector angle and magnitude
+        # Boundary vector angle and magnitude of every live car, in one pass
+        alive = [car for car in cars if car.alive]
+        distances = cast_beams([car.x for car in alive], [car.y for car in alive], road)
+        for car, row in zip(alive, distances):
+            car.set_radar_data(row)
 
 
         # Clear the screen
@@ -272,6 +331,9 @@ def eval_genomes(genomes, config):
         road.draw(SCREEN)
         target_car.draw(SCREEN)
 
+        # Road centre under every car, in one lookup
+        ys_on_road = road.get_y_at_x(np.array([car.x for car in cars]) + road.x_offset)
+
         # Update each car
         for i, car in enumerate(cars):
             if not car.alive:
@@ -289,8 +351,8 @@ def eval_genomes(genomes, config):
             car.update(output,road, road.x_offset)
 
             # ... inside the game loop in eval_genomes
-            y_on_road = road.get_y_at_x(car.x + road.x_offset)
-            if y_on_road is not None:
+            y_on_road = ys_on_road[i]
+            if not np.isnan(y_on_road):
                 distance_from_road = abs(car.y - y_on_road)
                 if distance_from_road < road.road_width // 2:  # Check if the car is on the road
                     ge[i].fitness += (road.road_width // 2 - distance_from_road)  # Reward being close to the center
@@ -324,6 +386,7 @@ def eval_genomes(genomes, config):
 
 # Configuration for NEAT
 def run_neat(config_path):
+    init_display()
     config = neat.config.Config(
         neat.DefaultGenome,
         neat.DefaultReproduction,
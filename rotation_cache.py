@@ -0,0 +1,70 @@
+"""Shared cache of rotated car sprites.
+
+Car orientations only change in ROTATION_STEP degree steps, so every source
+image has at most 360 / ROTATION_STEP distinct rotations. Each one is rotated
+once, on first use, together with the geometry the cars derive from it.
+"""
+import math
+
+import numpy as np
+import pygame
+
+ROTATION_STEP = 5
+ROTATIONS = 360 // ROTATION_STEP
+
+_cache = {}
+_tables = {}
+
+
+def quantize(angle):
+    """Index of the cached rotation closest to angle, in degrees."""
+    return int(round(angle / ROTATION_STEP)) % ROTATIONS
+
+
+class Rotation:
+    """A rotated copy of a car image and the offsets, from its rect corner, of what Car reads from it."""
+
+    def __init__(self, image, angle):
+        self.image = pygame.transform.rotate(image, angle)
+        self.width, self.height = self.image.get_size()
+        W, H = self.width, self.height
+        w, h = image.get_size()
+        cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+
+        # collision sensors at the front corners, as in Car.draw_sensors
+        if (angle <= 90 and angle >= 0):
+            self.left_sensor = (w*cos, 0)
+            self.right_sensor = (W, h*cos)
+        elif (angle < 360 and angle >= 270):
+            self.left_sensor = (W, w*(-1)*sin)
+            self.right_sensor = (w*cos, H)
+        elif (angle >= 180 and angle < 270):
+            self.left_sensor = (h*(-1)*sin, H)
+            self.right_sensor = (0, w*(-1)*sin)
+        else:
+            self.left_sensor = (0, h*(-1)*cos)
+            self.right_sensor = (h*sin, 0)
+
+        # know, know2, know3, know4
+        self.corners = ((0, 0), (W, H), (W, 0), (0, H))
+
+
+def rotate(image, angle):
+    """Returns the cached Rotation of image by angle, rounded to ROTATION_STEP."""
+    key = (image, quantize(angle))
+    if key not in _cache:
+        _cache[key] = Rotation(image, key[1] * ROTATION_STEP)
+    return _cache[key]
+
+
+def tables(image):
+    """Returns the sizes, left and right sensor offsets of every rotation of image.
+
+    Each is a (ROTATIONS, 2) array indexed by quantize(angle), for CarBatch.
+    """
+    if image not in _tables:
+        rotations = [rotate(image, i * ROTATION_STEP) for i in range(ROTATIONS)]
+        _tables[image] = (np.array([(r.width, r.height) for r in rotations]),
+                          np.array([r.left_sensor for r in rotations], dtype=float),
+                          np.array([r.right_sensor for r in rotations], dtype=float))
+    return _tables[image]
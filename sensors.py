@@ -0,0 +1,119 @@
+"""Geometric radar for the grid-track cars.
+
+The beams are intersected with the wall edges given by Road.walls() instead of
+walking the screen pixel by pixel, so the cost does not depend on the beam
+length and nothing has to be drawn before sensing.
+"""
+import numpy as np
+
+RADAR_ANGLES = np.array([-60, -30, 0, 30, 60])
+RADAR_MIN_LENGTH = 11  # first sample of the old pixel walk
+RADAR_MAX_LENGTH = 250
+
+# The pixel walk clamped its samples to these screen limits
+RADAR_X_MIN = 50
+RADAR_Y_MARGIN = 5
+
+# Network input layout: one distance per beam, then the traffic light flag
+TRAFFIC_COLUMN = len(RADAR_ANGLES)
+NUM_INPUTS = TRAFFIC_COLUMN + 1
+TRAFFIC_LIGHT_RANGE = 200
+
+# Cars sensed per NumPy pass, bounds the (cars, beams, segments) temporaries
+CHUNK = 1024
+
+
+def cast_rays(origins, angles, segments, max_length=RADAR_MAX_LENGTH):
+    """Returns the length of each ray up to the nearest segment.
+
+    origins is (N, 2), angles is (N, B) in degrees (counterclockwise, screen y
+    pointing down) and segments is (M, 4) as x1, y1, x2, y2. Rays that hit
+    nothing get max_length.
+    """
+    origins = np.asarray(origins, dtype=float)
+    rad = np.radians(angles)
+    dx = np.cos(rad)[:, :, None]
+    dy = -np.sin(rad)[:, :, None]
+
+    ax = segments[:, 0] - origins[:, 0, None]
+    ay = segments[:, 1] - origins[:, 1, None]
+    ex = segments[:, 2] - segments[:, 0]
+    ey = segments[:, 3] - segments[:, 1]
+    ax = ax[:, None, :]
+    ay = ay[:, None, :]
+
+    denom = dx * ey - dy * ex
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (ax * ey - ay * ex) / denom
+        u = (ax * dy - ay * dx) / denom
+    hit = (denom != 0) & (t >= 0) & (u >= 0) & (u <= 1)
+    t = np.where(hit, t, max_length)
+    return t.min(axis=2, initial=max_length)
+
+
+def radar_lengths(origins, angles, segments):
+    """Returns how far each radar beam travels before reaching a wall.
+
+    Beams that would cross x = RADAR_X_MIN are clamped there like the old
+    pixel walk, which then kept sampling straight up or down that column.
+    """
+    origins = np.asarray(origins, dtype=float)
+    lengths = cast_rays(origins, angles, segments)
+
+    rad = np.radians(angles)
+    cos, sin = np.cos(rad), np.sin(rad)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        to_clamp = (origins[:, 0, None] - RADAR_X_MIN) / -cos
+    clamped = (cos < 0) & (to_clamp < lengths)
+    if clamped.any():
+        columns = np.column_stack((np.full(clamped.sum(), RADAR_X_MIN),
+                                   origins[:, 1, None].repeat(angles.shape[1], axis=1)[clamped]
+                                   - sin[clamped] * to_clamp[clamped]))
+        vertical = np.where(sin[clamped] > 0, 90, 270)[:, None]
+        climb = cast_rays(columns, vertical, segments, RADAR_MAX_LENGTH)[:, 0]
+        with np.errstate(divide="ignore"):
+            lengths[clamped] = to_clamp[clamped] + climb / np.abs(sin[clamped])
+    return np.minimum(lengths, RADAR_MAX_LENGTH)
+
+
+def beam_ends(origins, angles, lengths, screen_height):
+    """Turns ray lengths into the integer end points and distances of the radar.
+
+    Mirrors the old pixel walk: the length is rounded up to the next sample,
+    the end point is truncated to a pixel and clamped to the screen margins.
+    Returns ends as (N, B, 2) and distances as (N, B), both integers.
+    """
+    origins = np.asarray(origins, dtype=float)
+    rad = np.radians(angles)
+    steps = np.clip(np.ceil(lengths), RADAR_MIN_LENGTH, RADAR_MAX_LENGTH)
+    x = (origins[:, 0, None] + np.cos(rad) * steps).astype(int)
+    y = (origins[:, 1, None] - np.sin(rad) * steps).astype(int)
+    x = np.maximum(x, RADAR_X_MIN)
+    y = np.clip(y, RADAR_Y_MARGIN, screen_height - RADAR_Y_MARGIN)
+    dist = np.hypot(origins[:, 0, None] - x, origins[:, 1, None] - y).astype(int)
+    return np.stack((x, y), axis=-1), dist
+
+
+def radar_matrix(centers, orientations, segments, screen_height, out):
+    """Senses the whole population at once.
+
+    Casts every beam of every car (centers (N, 2), orientations (N,) in
+    degrees) and writes the distances into the first columns of the
+    preallocated (N, NUM_INPUTS) input matrix. Returns the (N, B, 2) beam end
+    points for drawing.
+    """
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    orientations = np.asarray(orientations, dtype=float)
+    ends = np.empty((len(centers), len(RADAR_ANGLES), 2), dtype=int)
+    for start in range(0, len(centers), CHUNK):
+        block = slice(start, start + CHUNK)
+        angles = orientations[block, None] + RADAR_ANGLES
+        lengths = radar_lengths(centers[block], angles, segments)
+        ends[block], out[block, :TRAFFIC_COLUMN] = beam_ends(centers[block], angles, lengths, screen_height)
+    return ends
+
+
+def traffic_flags(left_x, traf_l_pos, out):
+    """Sets the traffic light column for cars less than TRAFFIC_LIGHT_RANGE before the light."""
+    gap = traf_l_pos - np.asarray(left_x, dtype=float)
+    out[:, TRAFFIC_COLUMN] = (gap < TRAFFIC_LIGHT_RANGE) & (gap > 0)
@@ -0,0 +1,84 @@
+"""Per-generation telemetry of the training loop.
+
+TickStats sums the wall time spent in each phase of an eval_genomes tick and
+counts the crashes by cause. Timing a phase is a single perf_counter call at
+its end, see TickStats.lap. TelemetryReporter emits the stats of every
+generation once, as a JSON record.
+"""
+import json
+import time
+
+import neat
+import numpy as np
+
+from car_batch import Crash
+
+PHASES = ('traffic_light', 'fitness', 'inference', 'shift', 'rotate_draw', 'move', 'sensing', 'collision',
+          'record')
+
+
+class TickStats:
+    """Wall time per tick phase and crashes per cause, summed over episodes."""
+
+    def __init__(self):
+        self.episodes = 0
+        self.ticks = 0
+        self.shifts = 0
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.crashes = np.zeros(len(Crash), dtype=int)
+        self._last = None
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        """Adds the time since the last lap, or start, to phase."""
+        now = time.perf_counter()
+        self.seconds[phase] += now - self._last
+        self._last = now
+
+    def count_crashes(self, causes):
+        self.crashes += np.bincount(causes, minlength=len(Crash))
+
+    def merge(self, other):
+        self.episodes += other.episodes
+        self.ticks += other.ticks
+        self.shifts += other.shifts
+        for phase in PHASES:
+            self.seconds[phase] += other.seconds[phase]
+        self.crashes += other.crashes
+
+    def as_dict(self):
+        return {
+            'episodes': self.episodes,
+            'ticks': self.ticks,
+            'shifts': self.shifts,
+            'seconds': dict(self.seconds),
+            'crashes': {cause.name.lower(): int(self.crashes[cause]) for cause in Crash if cause != Crash.NONE},
+        }
+
+
+class TelemetryReporter(neat.reporting.BaseReporter):
+    def __init__(self, take_stats, filename=None, verbosity=1):
+        """Emits what take_stats() returns after every generation's evaluation.
+
+        take_stats hands over the TickStats gathered since its last call. The
+        records are appended to filename as JSON lines, and printed when
+        verbosity is 1 or more.
+        """
+        self.take_stats = take_stats
+        self.filename = filename
+        self.verbosity = verbosity
+        self.generation = None
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def post_evaluate(self, config, population, species, best_genome):
+        record = dict(generation=self.generation, **self.take_stats().as_dict())
+        line = json.dumps(record)
+        if self.filename is not None:
+            with open(self.filename, 'a') as f:
+                f.write(line + '\n')
+        if self.verbosity >= 1:
+            print(line)
@@ -0,0 +1,61 @@
+"""When to end a grid-track episode before every car has crashed.
+
+TerminationPolicy bounds the ticks of an eval_genomes episode. It has three
+rules, each off unless configured:
+
+- max_ticks ends every car once the episode has run that many ticks.
+- progress_window ends a car that has not moved min_progress pixels further
+  along the track for that many ticks. Ticks spent waiting, stopped at a
+  red light or held at the end of the track portion, do not count.
+- stop_when_decided ends the episode once the best fitness belongs to a
+  car that has already left it, and no live car can reach that fitness in
+  the ticks max_ticks leaves. The best genome then keeps its place.
+
+The cars it ends leave the episode like crashed ones, with their own Crash
+cause.
+"""
+import numpy as np
+
+from car_batch import Crash
+
+
+class TerminationPolicy:
+    def __init__(self, max_ticks=None, progress_window=None, min_progress=50, stop_when_decided=False):
+        if stop_when_decided and max_ticks is None:
+            raise ValueError("stop_when_decided needs max_ticks to bound the fitness still to come")
+        self.max_ticks = max_ticks
+        self.progress_window = progress_window
+        self.min_progress = min_progress
+        self.stop_when_decided = stop_when_decided
+
+    def start(self, n):
+        """Resets the progress marks for an episode of n cars."""
+        self.mark = np.full(n, -np.inf)
+        self.mark_tick = np.zeros(n, dtype=int)
+
+    def check(self, tick, live, progress, fitness, max_gain, waiting=None):
+        """Returns the Crash cause ending each live car after tick, Crash.NONE for those going on.
+
+        progress is how far along the track each live car is, fitness the
+        fitness of every car so far and max_gain the most fitness a car can
+        earn in a tick. The live cars marked in waiting are not ended for a
+        lack of progress.
+        """
+        cause = np.full(len(live), Crash.NONE, dtype=np.int8)
+
+        if self.progress_window is not None:
+            advanced = progress >= self.mark[live] + self.min_progress
+            if waiting is not None:
+                advanced |= waiting
+            self.mark[live[advanced]] = progress[advanced]
+            self.mark_tick[live[advanced]] = tick
+            cause[tick - self.mark_tick[live] >= self.progress_window] = Crash.NO_PROGRESS
+
+        if self.max_ticks is not None and tick >= self.max_ticks:
+            cause[cause == Crash.NONE] = Crash.TICK_BUDGET
+        elif self.stop_when_decided and len(live):
+            best = np.argmax(fitness)
+            reach = fitness[live] + (self.max_ticks - tick) * max_gain
+            if best not in live and (reach < fitness[best]).all():
+                cause[cause == Crash.NONE] = Crash.DECIDED
+        return cause
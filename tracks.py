@@ -0,0 +1,81 @@
+"""Seeded grid tracks and a pre-generated library of them.
+
+generate(seed) draws a track from its own random.Random(seed), the same way
+Road.addpoint does, so a seed always gives the same track. A library is a
+single .npy file holding one record per track: its seed, the y and the
+traffic light state of its first points. load() memory-maps it read-only,
+so every worker process shares the same pages, and LibraryRoad plays a
+record back without copying it.
+
+    python tracks.py --out tracks.npy --count 1000 --seed 0
+"""
+import argparse
+import random
+
+import numpy as np
+
+import Road as road
+
+INITIAL_POINTS = 13  # the first point, then the 12 eval_genomes adds
+LIGHT_INDEX = 5  # eval_genomes turns the light of this point red
+TRACK_POINTS = INITIAL_POINTS + 100 * road.SHIFT_POINTS  # 100 shifts
+
+
+def generate(seed, points=TRACK_POINTS):
+    """Returns the y and light arrays of the first points of the track of seed."""
+    trak = road.Road(rng=random.Random(seed))
+    while len(trak) < points:
+        trak.addpoint()
+    trak.set_light(LIGHT_INDEX, 1)
+    return trak.y.copy(), trak.light.copy()
+
+
+def record_dtype(points=TRACK_POINTS):
+    return np.dtype([('seed', '<u8'), ('y', '<f8', (points,)), ('light', 'i1', (points,))])
+
+
+def build(filename, count, seed=0, points=TRACK_POINTS):
+    """Writes the tracks of seeds seed to seed + count - 1 to filename."""
+    library = np.lib.format.open_memmap(filename, mode='w+', dtype=record_dtype(points), shape=(count,))
+    for i in range(count):
+        library[i]['seed'] = seed + i
+        library[i]['y'], library[i]['light'] = generate(seed + i, points)
+    library.flush()
+    return library
+
+
+def load(filename):
+    """Memory-maps a library written by build, read-only."""
+    return np.load(filename, mmap_mode='r')
+
+
+class LibraryRoad(road.Road):
+    """A Road whose points are read from a library record instead of drawn.
+
+    Past the end of the record it regenerates the track from the record's
+    seed, so it goes on exactly as the generated track would.
+    """
+    def __init__(self, record):
+        self.seed = int(record['seed'])
+        self.ys = record['y']
+        self.lights = record['light']
+        self.next_point = 1
+        super().__init__()
+
+    def addpoint(self):
+        if self.next_point == len(self.ys):
+            self.ys, self.lights = generate(self.seed, 2 * len(self.ys))
+        self._walls = self._mask = None
+        l = self._count-1
+        self._append(self.x[l]+road.POINT_SPACING, self.ys[self.next_point], self.lights[self.next_point])
+        self.next_point += 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pre-generate a library of seeded grid tracks.")
+    parser.add_argument("--out", default="tracks.npy")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first track, the others follow")
+    parser.add_argument("--points", type=int, default=TRACK_POINTS, help="points stored per track")
+    args = parser.parse_args()
+    build(args.out, args.count, args.seed, args.points)